@@ -1,5 +1,6 @@
 from bw_secrets import API_TOKEN
 from cogs import ElectionCog, ElectionCogException
+import database as db
 import discord
 from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -91,6 +92,36 @@ async def start_election(
     }
 
 
+@app.get("/wse/{server_id}/prices")
+async def get_wse_prices(
+    server_id: int,
+    max_points: int = db.MAX_PRICE_POINTS,
+    token: str = Depends(verify_bearer_token),
+    bot: discord.Bot = Depends(get_bot)
+):
+    guild = bot.get_guild(server_id)
+
+    if guild is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Server not found"
+        )
+
+    if not 1 <= max_points <= db.MAX_PRICE_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"max_points must be between 1 and {db.MAX_PRICE_POINTS}"
+        )
+
+    resolution, history = await db.get_price_history(guild, max_points)
+
+    return {
+        "server_id": guild.id,
+        "resolution": resolution,
+        "candles": [{**candle, "bucket": candle["bucket"].isoformat()} for candle in history]
+    }
+
+
 # endregion
 
 async def run_api(bot: discord.Bot):
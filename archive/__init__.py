@@ -0,0 +1,3 @@
+from archive.exporter import ChannelExporter, EXPORT_DIR
+from archive.history import iter_history, serialize_message
+from archive.search_index import SearchIndex, INDEX_PATH
@@ -0,0 +1,146 @@
+import archive.history as history
+import asyncio
+import database as db
+from datetime import datetime
+import discord
+import gzip
+import json
+import logging
+import os
+
+try:
+    import zstandard
+except ImportError:  # optional, exports fall back to gzip
+    zstandard = None
+
+EXPORT_DIR = os.getenv("ARCHIVE_EXPORT_DIR", "exports")
+""" Directory archived channels are exported to, one subdirectory per guild """
+
+
+class ChannelExporter:
+    """ Streams an archived channel's full history into a compressed JSONL file. Messages
+        are written in batches, each batch as its own gzip member/zstd frame (readers
+        treat the concatenation as one stream), and the file size and last message ID
+        are checkpointed after each one. An interrupted export truncates any partial
+        batch and resumes from the checkpoint, and memory use is bounded by one batch
+        however big the channel is """
+    log = logging.getLogger(f"{__name__}.ChannelExporter")
+
+    def __init__(self, channel: discord.TextChannel, directory: str = EXPORT_DIR,
+                 batch_size: int = 1000, compression: str | None = None) -> None:
+        self.channel: discord.TextChannel = channel
+        """ Channel being exported """
+        self.directory: str = directory
+        self.batch_size: int = batch_size
+        """ Messages written between each checkpoint """
+        self.compression: str = compression or ("zstd" if zstandard is not None else "gzip")
+        """ 'zstd' (if zstandard is installed) or 'gzip' """
+        self.export: dict = {}
+        """ Progress of the export, as checkpointed to the DB """
+
+    def __str__(self) -> str:
+        return (f"Export of '{self.channel.name}' in '{self.channel.guild.name}': "
+                f"{self.export.get('messages', 0):,} messages, {self.export.get('size', 0):,} bytes")
+
+    async def run(self) -> dict:
+        """ Exports (or finishes exporting) the channel, returns the export's manifest """
+        cursor = await db.get_export_cursor(self.channel)
+        if cursor is not None and cursor.get("done"):
+            return cursor["manifest"]
+
+        if cursor is None:
+            extension = "zst" if self.compression == "zstd" else "gz"
+            self.export = {
+                "path": os.path.join(self.directory, str(self.channel.guild.id),
+                                     f"{self.channel.id}-{self.channel.name}.jsonl.{extension}"),
+                "compression": self.compression,
+                "size": 0,
+                "messages": 0,
+                "first_message_id": None,
+                "first_message_at": None,
+                "last_message_id": None,
+                "last_message_at": None,
+                "done": False
+            }
+            # recorded before anything is written, so an export interrupted before its
+            # first batch is still found and resumed at startup
+            await db.save_export_cursor(self.channel, self.export)
+        else:
+            self.export = {key: value for key, value in cursor.items()
+                           if key not in ("_id", "server_id", "channel_name", "last_updated")}
+        await asyncio.to_thread(ChannelExporter.__prepare_file, self.export["path"], self.export["size"])
+        ChannelExporter.log.info(f"Starting {self}")
+
+        batch: list[dict] = []
+        async for message in history.iter_history(self.channel, self.export["last_message_id"]):
+            batch.append(message)
+            if len(batch) == self.batch_size:
+                await self.__checkpoint(batch, False)
+                batch = []
+        await self.__checkpoint(batch, True)
+
+        ChannelExporter.log.info(f"Finished {self}")
+        return self.export["manifest"]
+
+    async def __checkpoint(self, batch: list[dict], done: bool) -> None:
+        # the batch is on disk before the cursor moves past it
+        if batch:
+            self.export["size"] = await asyncio.to_thread(
+                ChannelExporter.__append_batch, self.export["path"], batch, self.export["compression"])
+            if self.export["first_message_id"] is None:
+                self.export["first_message_id"] = batch[0]["id"]
+                self.export["first_message_at"] = batch[0]["created_at"]
+            self.export["last_message_id"] = batch[-1]["id"]
+            self.export["last_message_at"] = batch[-1]["created_at"]
+            self.export["messages"] += len(batch)
+        if done:
+            self.export["done"] = True
+            self.export["manifest"] = self.__manifest()
+            await asyncio.to_thread(ChannelExporter.__write_manifest,
+                                    self.export["path"] + ".manifest.json", self.export["manifest"])
+        await db.save_export_cursor(self.channel, self.export)
+
+    def __manifest(self) -> dict:
+        return {
+            "channel_id": self.channel.id,
+            "channel_name": self.channel.name,
+            "server_id": self.channel.guild.id,
+            "server_name": self.channel.guild.name,
+            "path": self.export["path"],
+            "format": "jsonl",
+            "compression": self.export["compression"],
+            "size": self.export["size"],
+            "messages": self.export["messages"],
+            "first_message_id": self.export["first_message_id"],
+            "first_message_at": self.export["first_message_at"],
+            "last_message_id": self.export["last_message_id"],
+            "last_message_at": self.export["last_message_at"],
+            "exported_at": datetime.now().isoformat()
+        }
+
+    @staticmethod
+    def __prepare_file(path: str, size: int) -> None:
+        """ Creates the export's directory and drops anything past the last checkpoint """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as file:
+            file.truncate(size)
+
+    @staticmethod
+    def __append_batch(path: str, batch: list[dict], compression: str) -> int:
+        """ Appends the batch as one compressed member/frame, returns the new file size """
+        data = "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in batch).encode()
+        with open(path, "ab") as file:
+            if compression == "zstd":
+                if zstandard is None:
+                    raise Exception("This export is zstd compressed but zstandard isn't installed")
+                file.write(zstandard.ZstdCompressor().compress(data))
+            else:
+                file.write(gzip.compress(data))
+            file.flush()
+            os.fsync(file.fileno())
+            return file.tell()
+
+    @staticmethod
+    def __write_manifest(path: str, manifest: dict) -> None:
+        with open(path, "w") as file:
+            json.dump(manifest, file, indent=4)
@@ -0,0 +1,27 @@
+import discord
+from typing import AsyncIterator
+
+
+def serialize_message(message: discord.Message) -> dict:
+    """ Returns the parts of a message worth keeping once its channel is archived """
+    return {
+        "id": message.id,
+        "created_at": message.created_at.isoformat(),
+        "edited_at": None if message.edited_at is None else message.edited_at.isoformat(),
+        "author_id": message.author.id,
+        "author_name": message.author.name,
+        "bot": message.author.bot,
+        "content": message.content,
+        "mentions": [user.id for user in message.mentions],
+        "attachments": [attachment.url for attachment in message.attachments],
+        "reply_to": None if message.reference is None else message.reference.message_id
+    }
+
+
+async def iter_history(channel: discord.TextChannel,
+                       after_id: int | None = None) -> AsyncIterator[dict]:
+    """ Yields the channel's messages oldest first, starting after the given message ID.
+        Pages are fetched lazily, so only one page is held in memory at a time """
+    after = None if after_id is None else discord.Object(id=after_id)
+    async for message in channel.history(limit=None, after=after, oldest_first=True):
+        yield serialize_message(message)
@@ -0,0 +1,145 @@
+import gzip
+import io
+import json
+import os
+import sqlite3
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed to read zstd exports
+    zstandard = None
+
+INDEX_PATH = os.getenv("ARCHIVE_INDEX_PATH", os.path.join("exports", "archive_index.db"))
+""" SQLite file holding the full-text index of archived channels """
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    server_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    channel_name TEXT NOT NULL,
+    author_id INTEGER NOT NULL,
+    author_name TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (server_id, created_at);
+CREATE INDEX IF NOT EXISTS messages_by_author ON messages (server_id, author_name COLLATE NOCASE);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TABLE IF NOT EXISTS indexed_channels (
+    channel_id INTEGER PRIMARY KEY,
+    last_message_id INTEGER NOT NULL
+);
+"""
+
+
+class SearchIndex:
+    """ Full-text (SQLite FTS5) index of archived channels, fed from their JSONL exports.
+        Each channel's last indexed message is remembered, so re-indexing an export only
+        adds what's new. The database is in WAL mode and each searching thread has its
+        own connection, so searches never wait on an export being indexed, and the write
+        lock is only held for one batch at a time. Calls block, run them with
+        asyncio.to_thread """
+
+    def __init__(self, path: str = INDEX_PATH) -> None:
+        self.path: str = path
+        self.__connection: sqlite3.Connection | None = None
+        """ Connection all writes go through, guarded by __write_lock """
+        self.__write_lock = threading.Lock()
+        self.__readers = threading.local()
+        """ Per-thread read connections """
+
+    def __connect(self) -> sqlite3.Connection:
+        with self.__write_lock:
+            if self.__connection is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+                connection.row_factory = sqlite3.Row
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(SCHEMA)
+                self.__connection = connection
+            return self.__connection
+
+    def __reader(self) -> sqlite3.Connection:
+        connection = getattr(self.__readers, "connection", None)
+        if connection is None:
+            self.__connect()  # makes sure the file and schema exist
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            self.__readers.connection = connection
+        return connection
+
+    def add_export(self, manifest: dict, batch_size: int = 1000) -> int:
+        """ Indexes the messages of an exported channel that aren't indexed yet,
+            returns how many were added """
+        row = self.__reader().execute("SELECT last_message_id FROM indexed_channels WHERE channel_id = ?",
+                                      (manifest["channel_id"],)).fetchone()
+        last_message_id = 0 if row is None else row["last_message_id"]
+        added = 0
+        batch = []
+        with SearchIndex.__open_export(manifest["path"], manifest["compression"]) as lines:
+            for line in lines:
+                message = json.loads(line)
+                if message["id"] <= last_message_id:
+                    continue
+                batch.append((message["id"], manifest["server_id"], manifest["channel_id"],
+                              manifest["channel_name"], message["author_id"], message["author_name"],
+                              message["created_at"], message["content"]))
+                if len(batch) == batch_size:
+                    added += self.__insert(manifest["channel_id"], batch)
+                    batch = []
+        added += self.__insert(manifest["channel_id"], batch)
+        return added
+
+    def __insert(self, channel_id: int, batch: list[tuple]) -> int:
+        if not batch:
+            return 0
+        connection = self.__connect()
+        with self.__write_lock, connection:
+            cursor = connection.executemany(
+                "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            # the same channel can be indexed twice at once, never move its mark backwards
+            connection.execute("INSERT INTO indexed_channels VALUES (?, ?) ON CONFLICT (channel_id) "
+                               "DO UPDATE SET last_message_id = "
+                               "MAX(last_message_id, excluded.last_message_id)",
+                               (channel_id, batch[-1][0]))
+        return cursor.rowcount
+
+    @staticmethod
+    def __open_export(path: str, compression: str) -> io.TextIOBase:
+        if compression == "zstd":
+            if zstandard is None:
+                raise Exception("This export is zstd compressed but zstandard isn't installed")
+            reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                                 closefd=True)
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return gzip.open(path, "rt", encoding="utf-8")
+
+    def search(self, server_id: int, keywords: list[str], author: str | None = None,
+               after: str | None = None, before: str | None = None, limit: int = 10) -> list[dict]:
+        """ Returns the best matches for all the keywords in the guild's archives, optionally
+            only from one author (by name) and between two ISO dates """
+        query = " ".join('"' + keyword.replace('"', '""') + '"' for keyword in keywords)
+        sql = ("SELECT m.id, m.channel_id, m.channel_name, m.author_name, m.created_at, "
+               "snippet(messages_fts, 0, '**', '**', '...', 16) AS snippet "
+               "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+               "WHERE messages_fts MATCH ? AND m.server_id = ?")
+        params: list = [query, server_id]
+        if author is not None:
+            sql += " AND m.author_name = ? COLLATE NOCASE"
+            params.append(author)
+        if after is not None:
+            sql += " AND m.created_at >= ?"
+            params.append(after)
+        if before is not None:
+            sql += " AND m.created_at < ?"
+            params.append(before)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self.__reader().execute(sql, params)]
@@ -0,0 +1 @@
+from backfill.history_backfill import HistoryBackfill
\ No newline at end of file
@@ -0,0 +1,141 @@
+import asyncio
+import database as db
+from datetime import datetime
+import discord
+import logging
+import time
+from typing import Awaitable, Callable
+
+
+class HistoryBackfill:
+    """ Rebuilds message stats by paging through text channel history. Channels are read
+        concurrently, but each channel's history is its own Discord rate-limit bucket,
+        so one pager per channel plus a cap on how many run at once keeps us clear of
+        both the per-route and the global limits (pycord waits out any 429s). Progress is
+        checkpointed per channel, so a run with the same name resumes where it left off.
+        Counts are added on top of the live totals, so the window should only cover time
+        the bot wasn't counting (e.g. an outage), and it never extends past db.LIVE_SINCE """
+    log = logging.getLogger(f"{__name__}.HistoryBackfill")
+
+    def __init__(self, guilds: list[discord.Guild], after: datetime, before: datetime,
+                 run: str | None = None, concurrency: int = 4, batch_size: int = 500) -> None:
+        before = min(before, db.LIVE_SINCE)
+        if after >= before:
+            raise ValueError(f"Backfill window {after} - {before} is empty")
+        self.guilds: list[discord.Guild] = guilds
+        """ Guilds whose text channels get backfilled """
+        self.after: datetime = after
+        """ Only count messages sent after this """
+        self.before: datetime = before
+        """ Only count messages sent before this """
+        self.run_name: str = run if run is not None else f"{after.date()}_{before.date()}"
+        """ Name the per-channel resume cursors are stored under """
+        self.batch_size: int = batch_size
+        """ Messages counted between each stats write/cursor checkpoint """
+        self.channels_total: int = 0
+        self.channels_done: int = 0
+        self.messages: int = 0
+        self.started: float | None = None
+        self.__semaphore = asyncio.Semaphore(concurrency)
+
+    def __str__(self) -> str:
+        return (f"Backfill '{self.run_name}': {self.channels_done}/{self.channels_total} "
+                f"channels, {self.messages:,} messages ({self.messages_per_second():,.1f} msg/s)")
+
+    def messages_per_second(self) -> float:
+        if self.started is None:
+            return 0
+        return self.messages / max(time.monotonic() - self.started, 1e-9)
+
+    async def run(self, on_progress: Callable[["HistoryBackfill"], Awaitable[None]] | None = None,
+                  report_interval: float = 15) -> None:
+        """ Backfills every text channel of every guild, returns once all are done.
+            on_progress (if given) is awaited every report_interval seconds """
+        channels = [channel for guild in self.guilds for channel in guild.text_channels]
+        self.channels_total = len(channels)
+        self.started = time.monotonic()
+        HistoryBackfill.log.info(f"Starting {self}")
+        reporter = asyncio.create_task(self.__report(on_progress, report_interval))
+        try:
+            await asyncio.gather(*(self.__backfill_channel_guarded(channel)
+                                   for channel in channels))
+        finally:
+            reporter.cancel()
+        HistoryBackfill.log.info(f"Finished {self}")
+        if on_progress is not None:
+            await on_progress(self)
+
+    async def __report(self, on_progress: Callable[["HistoryBackfill"], Awaitable[None]] | None,
+                       report_interval: float) -> None:
+        while True:
+            await asyncio.sleep(report_interval)
+            HistoryBackfill.log.info(str(self))
+            if on_progress is not None:
+                try:
+                    await on_progress(self)
+                except Exception as ex:
+                    HistoryBackfill.log.error(f"Failed to report backfill progress: {ex}")
+
+    async def __backfill_channel_guarded(self, channel: discord.TextChannel) -> None:
+        async with self.__semaphore:
+            try:
+                await self.backfill_channel(channel)
+            except discord.Forbidden:
+                HistoryBackfill.log.info(f"No access to history of '{channel.name}' in "
+                                         f"'{channel.guild.name}', skipping")
+            except Exception as ex:
+                HistoryBackfill.log.error(f"Backfill of '{channel.name}' in "
+                                          f"'{channel.guild.name}' failed: {ex}")
+        self.channels_done += 1
+
+    async def backfill_channel(self, channel: discord.TextChannel) -> None:
+        """ Counts the channel's messages from its resume cursor onwards, writing the
+            counts and advancing the cursor every batch """
+        cursor = await db.get_backfill_cursor(channel, self.run_name)
+        if cursor is not None and cursor.get("done"):
+            return
+        after = self.after
+        if cursor is not None and cursor.get("last_message_id") is not None:
+            after = discord.Object(id=cursor["last_message_id"])
+
+        pending: dict[tuple[int, int, str, datetime], int] = {}
+        names: dict[tuple[int, int], tuple[str, str, bool]] = {}
+        counted = 0
+        last_message_id = None if cursor is None else cursor.get("last_message_id")
+        async for message in channel.history(limit=None, after=after, before=self.before,
+                                             oldest_first=True):
+            self.__count(message, pending, names)
+            counted += 1
+            last_message_id = message.id
+            if counted == self.batch_size:
+                await self.__checkpoint(channel, pending, names, last_message_id, counted, False)
+                pending, names, counted = {}, {}, 0
+        await self.__checkpoint(channel, pending, names, last_message_id, counted, True)
+
+    async def __checkpoint(self, channel: discord.TextChannel,
+                           pending: dict[tuple[int, int, str, datetime], int],
+                           names: dict[tuple[int, int], tuple[str, str, bool]],
+                           last_message_id: int | None, counted: int, done: bool) -> None:
+        await db.write_backfill_batch(channel, self.run_name, pending, names,
+                                      last_message_id, counted, done)
+        self.messages += counted
+
+    @staticmethod
+    def __count(message: discord.Message,
+                pending: dict[tuple[int, int, str, datetime], int],
+                names: dict[tuple[int, int], tuple[str, str, bool]]) -> None:
+        """ Counts a message the same way EventsCog.on_message does """
+        guild = message.guild
+        hour = db.bucket_start(message.created_at, "hour")
+        author = message.author
+        key = (guild.id, author.id, "sent_messages", hour)
+        pending[key] = pending.get(key, 0) + 1
+        names[(guild.id, author.id)] = (guild.name, author.name, bool(author.bot))
+        if author.bot:
+            return
+        for user in message.mentions:
+            if user.id == author.id:
+                continue
+            key = (guild.id, user.id, "mentioned", hour)
+            pending[key] = pending.get(key, 0) + 1
+            names[(guild.id, user.id)] = (guild.name, user.name, bool(user.bot))
@@ -2,16 +2,28 @@ from ai import LLMEngine, VisionEngine
 from cogs import (ArchiveCog, ElectionCog, EventsCog,
                   MiscellaneousCog, StatisticsCog, VoiceCog,
                   WSECog)
+import database as db
 import discord
 from discord.ext import commands
 from utilities import get_server_prefix
 
+
+class WalarusBot(commands.Bot):
+    """ Bot that writes any buffered DB state before it shuts down """
+
+    async def close(self) -> None:
+        try:
+            await db.flush_user_stats()
+        finally:
+            await super().close()
+
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.voice_states = True
 
-BOT: commands.Bot = commands.Bot(
+BOT: commands.Bot = WalarusBot(
     command_prefix=get_server_prefix(), intents=intents)
 llm_engine: LLMEngine = LLMEngine()
 vision_engine: VisionEngine = VisionEngine()
@@ -0,0 +1,10 @@
+""" Chart rendering. Kept free of bot/DB imports, and every chart draws on its own
+matplotlib Figure (never pyplot), so renders share no global state """
+from charts.price_chart import render_price_chart
+from charts.fan_chart import render_fan_chart
+import asyncio
+
+
+async def render(fn, *args) -> bytes:
+    """ Runs a chart render function in a worker thread, off the event loop """
+    return await asyncio.to_thread(fn, *args)
@@ -0,0 +1,28 @@
+import io
+from matplotlib.figure import Figure
+
+
+def render_fan_chart(percentiles: list[float], bands: list[list[float]]) -> bytes:
+    """ Renders simulated price percentiles by day as a PNG fan chart. bands holds
+        one series per percentile, lowest first; outer pairs are shaded lighter and
+        the middle series (the median, for an odd count) is drawn as a line """
+    fig = Figure()
+    ax = fig.subplots()
+    fig.set_figwidth(15)
+    ax.set_ylabel("Price", labelpad=25)
+    ax.yaxis.set_major_formatter('${x:1.2f}')
+    ax.set_xlabel("Day", labelpad=25)
+    days = list(range(len(bands[0])))
+
+    pairs = len(bands) // 2
+    for i in range(pairs):
+        low, high = bands[i], bands[-1 - i]
+        ax.fill_between(days, low, high, alpha=0.15 + 0.2 * i, color="tab:blue",
+                        label=f"p{percentiles[i]:g}-p{percentiles[-1 - i]:g}")
+    if len(bands) % 2 == 1:
+        ax.plot(days, bands[pairs], color="tab:blue", label=f"p{percentiles[pairs]:g}")
+    ax.legend(loc="upper left")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches='tight')
+    return buffer.getvalue()
@@ -0,0 +1,22 @@
+import io
+from matplotlib.figure import Figure
+
+
+def render_price_chart(timestamps: list[str], prices: list[float],
+                       lows: list[float] | None = None, highs: list[float] | None = None) -> bytes:
+    """ Renders the WSE price history as a PNG, shading each point's low-high range
+        when the history has been downsampled to candles """
+    fig = Figure()
+    ax = fig.subplots()
+    fig.set_figwidth(15)
+    ax.set_ylabel("Price", labelpad=25)
+    ax.yaxis.set_major_formatter('${x:1.2f}')
+    ax.set_xlabel("Date", labelpad=25)
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.plot(timestamps, prices, marker="o")
+    if lows is not None and highs is not None:
+        ax.fill_between(timestamps, lows, highs, alpha=0.25)
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches='tight')
+    return buffer.getvalue()
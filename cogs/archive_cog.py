@@ -1,3 +1,4 @@
+from archive import ChannelExporter, SearchIndex
 import asyncio
 import discord
 from discord.ext.commands import Cog
@@ -5,9 +6,32 @@ from discord.ext import commands
 import discord.utils
 import database as db
 from datetime import timedelta, datetime
+from globals import servers, timers
+import pytz
 from pytz import timezone
 import logging
-from osdk import OsdkActions
+from models import ArchiveRun, ChannelIndex
+from osdk import OsdkActions, OsdkObjects
+from utilities import send_message
+import time
+
+ARCHIVE_CONCURRENCY = 5
+""" Most guilds archived at the same time """
+ARCHIVE_TIMEOUT = 120
+""" Seconds one guild's archive may take before it's abandoned """
+ARCHIVE_STAGGER = timedelta(minutes=1)
+""" Gap between the first archives of guilds that start from the same date """
+ARCHIVE_RUN_GRACE = 2 * ARCHIVE_STAGGER
+""" How long a scheduled archive run stays open for more guilds after its last one finishes """
+CATEGORY_CHANNEL_LIMIT = 50
+""" Most channels Discord allows in one category """
+EXPORT_CONCURRENCY = 2
+""" Most archived channels exported at the same time """
+
+_running_exports: dict[int, asyncio.Task] = {}
+""" Export of each archived channel that's still running, by channel ID. A channel is
+    only ever exported by one task, since two would append to the same file """
+
 
 class ArchiveCog(Cog, name="Archive"):
     """ Class containing commands pertaining to archiving general chat """
@@ -15,6 +39,18 @@ class ArchiveCog(Cog, name="Archive"):
 
     def __init__(self, bot: discord.Bot) -> None:
         self.bot = bot
+        self.last_runs: dict[int, ArchiveRun] = {}
+        """ Report of each guild's most recent scheduled archive run, by guild ID """
+        self.current_run: ArchiveRun | None = None
+        """ Report of the scheduled archive run in progress. Every guild whose archive
+            fires while it's going (e.g. staggered guilds) is recorded in it """
+        self.current_run_guilds: int = 0
+        """ Guilds of the current run still archiving """
+        self.semaphore = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+        """ Bounds how many guilds archive at once when their schedules line up """
+        self.export_semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+        self.search_index = SearchIndex()
+        """ Full-text index of archived channels, fed by their exports """
 
     # region Commands
 
@@ -24,97 +60,325 @@ class ArchiveCog(Cog, name="Archive"):
         if ctx.guild is None:
             raise Exception("ctx.guild is None")
         if ctx.author.id == ctx.guild.owner_id:
-            await self.archive_general(ctx.guild)
+            try:
+                await self.archive_general(ctx.guild)
+            except Exception as ex:
+                ArchiveCog.log.error(str(ex))
+                await ctx.send(f"Archiving failed: {ex}")
         else:
             await ctx.send("Only the owner can use this command")
 
+    @commands.command(name="archivereport", aliases=["lastarchive"])
+    async def archive_report(self, ctx: commands.Context) -> None:
+        """ Command that shows how this server fared in the last scheduled archive run """
+        if ctx.guild is None:
+            raise Exception("ctx.guild is None")
+        last_run = self.last_runs.get(ctx.guild.id)
+        if last_run is None:
+            await ctx.send("There hasn't been a scheduled archive run for this server yet")
+            return
+        _, outcome, seconds, error = last_run.results[ctx.guild.id]
+        await ctx.send(f"Last archive run ({last_run.started:%m/%d/%Y %H:%M}): {outcome} "
+                       f"in {seconds:.1f}s" + ("" if error is None else f" ({error})"))
+
+    @commands.command(name="search", aliases=["searcharchive"])
+    async def search_archives(self, ctx: commands.Context, *terms: str) -> None:
+        """ Command that searches archived channels, e.g. `search walrus author:name
+            after:2024-01-01 before:2024-06-01` """
+        if ctx.guild is None:
+            raise Exception("ctx.guild is None")
+        keywords: list[str] = []
+        filters: dict[str, str] = {}
+        for term in terms:
+            key, _, value = term.partition(":")
+            if key.lower() in ("author", "after", "before") and value:
+                filters[key.lower()] = value
+            else:
+                keywords.append(term)
+        if not keywords:
+            await ctx.send("Give me something to search for, e.g. `search walrus author:name "
+                           "after:2024-01-01 before:2024-06-01`")
+            return
+        try:
+            after, before = (None if filters.get(key) is None else
+                             datetime.strptime(filters[key], "%Y-%m-%d").date().isoformat()
+                             for key in ("after", "before"))
+        except ValueError:
+            await ctx.send("Dates need to look like YYYY-MM-DD")
+            return
+
+        started = time.monotonic()
+        results = await asyncio.to_thread(self.search_index.search, ctx.guild.id, keywords,
+                                          filters.get("author"), after, before)
+        took = (time.monotonic() - started) * 1000
+        if not results:
+            await ctx.send(f"No archived messages found ({took:.0f} ms)")
+            return
+        message = f"Top {len(results)} archived messages ({took:.0f} ms):\n"
+        for result in results:
+            message += (f"[{result['created_at'][:10]}] #{result['channel_name']} "
+                        f"**{result['author_name']}**: {result['snippet']} "
+                        f"(https://discord.com/channels/{ctx.guild.id}/{result['channel_id']}/{result['id']})\n")
+        await send_message(ctx.channel, message)
+
+    @commands.command(name="reindex", aliases=["indexarchives"])
+    async def reindex_archives(self, ctx: commands.Context) -> None:
+        """ Command that exports and indexes every channel already in the archive category
+            that hasn't been exported yet """
+        if ctx.guild is None:
+            raise Exception("ctx.guild is None")
+        if ctx.author.id != ctx.guild.owner_id:
+            await ctx.send("Only the owner can use this command")
+            return
+        archive_cat_name = await db.get_archive_category(ctx.guild)
+        channels = [channel for category in ArchiveCog.channel_index(ctx.guild).find_categories(archive_cat_name)
+                    for channel in category.text_channels]
+        finished = await db.get_finished_exports([channel.id for channel in channels])
+        channels = [channel for channel in channels
+                    if channel.id not in finished and not ArchiveCog.export_running(channel)]
+        for channel in channels:
+            self.start_export(channel)
+        await ctx.send(f"Exporting and indexing {len(channels)} archived channel(s) in the background")
+
     @commands.command(name="nextarchivedate", aliases=["nextarchive"])
     async def next_archive_date_command(self, ctx: commands.Context) -> None:
-        """ Command that sends the date of the next general chat archive. 
-            Assumes global archive date """
+        """ Command that sends the date of the next general chat archive in this server """
         if ctx.guild is None:
             raise Exception("ctx.guild is None")
-        eastern = timezone("US/Eastern")
-        date = db.get_next_archive_date()
+        server = servers.get(ctx.guild)
+        if server is None or server.next_archive_at is None:
+            await ctx.send("General chat isn't scheduled to be archived in this server yet")
+            return
+        date = server.next_archive_at.astimezone(timezone(server.timezone))
         hour = date.hour % 12
         if date.hour == 12 or date.hour == 0:
             hour = "12"
         meridiem = "AM" if date.hour < 12 else "PM"
         dt_str = (f"{date.month}/{date.day}/{date.year} {hour}:{date.minute:<02} "
-                  f"{meridiem} EST")
+                  f"{meridiem} {date:%Z}")
         await ctx.send(f"Next archive date: {dt_str}")
 
     # endregion
 
     # region Helper Functions
 
-    async def archive_general(self, guild: discord.Guild, freq=2, try_time=0) -> None:
-        """ Houses the actual logic of archiving general chat """
-        if try_time == 3:  # recursive base case for protection
-            return
-
-        archive_cat_name = db.get_archive_category(guild)
-        name = db.get_chat_to_archive(guild)
-        new_name = db.get_archived_name(name)
+    async def archive_general(self, guild: discord.Guild, freq=2,
+                              run: ArchiveRun | None = None) -> None:
+        """ Houses the actual logic of archiving general chat, raises if it fails. The
+            archived channel is named after the guild's next archive date (now, if it
+            isn't scheduled). Each step is noted in run, if given """
+        server = servers.get(guild)
+        tz = timezone("US/Eastern" if server is None else server.timezone)
+        archived_on = (datetime.now(tz) if server is None or server.next_archive_at is None
+                       else server.next_archive_at.astimezone(tz))
+        settings = await db.get_server_settings(guild)
+        archive_cat_name = str(settings["archive_category"])
+        name = str(settings["chat_to_archive"])
+        new_name = db.archived_name(name, archived_on)
         archive_category = await self.get_channel_category(guild, archive_cat_name, False)
+        chat_to_archive, general_category = self.get_channel_to_archive(guild, name, False)
+        if ArchiveCog.channel_index(guild).child_count(archive_category) >= CATEGORY_CHANNEL_LIMIT:
+            # full category, archive into a fresh one above it
+            ArchiveCog.log.info((f"Channel category '{archive_cat_name}' reached limit of "
+                                 f"{CATEGORY_CHANNEL_LIMIT} channels in '{guild.name}' (id: {guild.id})"))
+            archive_category = await guild.create_category_channel(
+                archive_cat_name, position=archive_category.position-1)
+
+        # the new channel is only opened once the old one is out of the way, so a failed
+        # move or rename never leaves two channels with the same name
         try:
-            chat_to_archive, general_category = self.get_channel_to_archive(guild, name, False)
             await chat_to_archive.move(beginning=True, category=archive_category, sync_permissions=True)
-            await chat_to_archive.edit(name=new_name)
-            new_channel = await guild.create_text_channel(name, category=general_category)
-            await new_channel.send("good morning @everyone")
-
-            # OSDK update
-            OsdkActions.upsert_archive_event(chat_to_archive, archive_category)
-            OsdkActions.upsert_guild(guild, next_archive_date=db.get_next_archive_date().date())
         except discord.HTTPException as ex:
-            if ex.code == 50035:  # too many channels in category, make new archive category
-                ArchiveCog.log.info((f"Channel category '{archive_cat_name}' reached limit of "
-                          f"50 channels in '{guild.name}' (id: {guild.id})"))
-                await guild.create_category_channel(archive_cat_name, position=archive_category.position-1)
-                await self.archive_general(guild, try_time=try_time+1)
-            else:
-                ArchiveCog.log.error(str(ex))
-        except Exception as ex:
-            ArchiveCog.log.error(str(ex))
-
-    async def repeat_archive(self, freq: timedelta) -> None:
-        """ Handles repeatedly archiving general chat """
-        await self.sleep_until_archive()
-        while True:
-            db.update_next_archive_date(freq)
-            for guild in self.bot.guilds:
-                now = datetime.now()
+            if ex.code != 50035:
+                raise
+            # the index undercounted and the category is full, retry once in a fresh one
+            ArchiveCog.log.info((f"Channel category '{archive_cat_name}' reached limit of "
+                                 f"{CATEGORY_CHANNEL_LIMIT} channels in '{guild.name}' (id: {guild.id})"))
+            archive_category = await guild.create_category_channel(
+                archive_cat_name, position=archive_category.position-1)
+            await chat_to_archive.move(beginning=True, category=archive_category, sync_permissions=True)
+        if run is not None:
+            run.reach(guild, "moved")
+        await chat_to_archive.edit(name=new_name)
+        if run is not None:
+            run.reach(guild, "renamed")
+        new_channel = await guild.create_text_channel(name, category=general_category)
+        await new_channel.send("good morning @everyone")
+        if run is not None:
+            run.reach(guild, "new channel opened")
+
+        # OSDK update (blocking calls, run off the event loop side by side)
+        next_archive_at = None if server is None else server.next_archive_at
+        await asyncio.gather(
+            asyncio.to_thread(OsdkActions.upsert_archive_event, chat_to_archive, archive_category),
+            asyncio.to_thread(OsdkActions.upsert_guild, guild,
+                              next_archive_date=None if next_archive_at is None
+                              else next_archive_at.astimezone(tz).date()))
+        # the export can take a while on big channels, so it runs outside the archive's timeout
+        self.start_export(chat_to_archive)
+
+    async def start_archive_schedule(self) -> None:
+        """ Puts every guild's next archive on the shared timer queue. Guilds without a
+            schedule of their own start from the legacy global archive date, a minute
+            apart, so their archives don't all hit Discord at once """
+        frequencies = await ArchiveCog.load_archive_frequencies()
+        legacy_date: datetime | None = None
+        staggered = 0
+        for guild in self.bot.guilds:
+            server = servers.get(guild)
+            if server is None:
+                continue
+            if guild.id in frequencies:
+                server.archive_int = frequencies[guild.id]
+            first_archive = None
+            if server.next_archive_at is None:
+                if legacy_date is None:
+                    try:
+                        legacy_date = await db.get_next_archive_date()
+                    except Exception:
+                        legacy_date = datetime.now(pytz.utc)
+                first_archive = legacy_date + staggered * ARCHIVE_STAGGER
+                staggered += 1
+            await self.schedule_archive(guild, first_archive)
+        timers.start()
+
+        for export in await db.get_unfinished_exports():
+            channel = self.bot.get_channel(export["_id"])
+            if isinstance(channel, discord.TextChannel):
+                self.start_export(channel)
+
+    async def schedule_archive(self, guild: discord.Guild, first_archive: datetime | None = None) -> None:
+        """ Puts the guild's next archive on the shared timer queue. A guild without a
+            schedule yet gets its first archive at first_archive (or one archive
+            interval from now) """
+        server = servers.get(guild)
+        if server is None:
+            return
+        if server.next_archive_at is None:
+            now = datetime.now(pytz.utc)
+            server.next_archive_at = (server.next_archive_after(now, now) if first_archive is None
+                                      else first_archive)
+            await db.set_next_archive_at(guild, server.next_archive_at)
+
+        async def archive() -> None:
+            await self.scheduled_archive(guild)
+
+        timers.schedule(("archive", guild.id), server.next_archive_at, archive)
+
+    @staticmethod
+    def unschedule_archive(guild: discord.Guild) -> None:
+        timers.cancel(("archive", guild.id))
+
+    async def scheduled_archive(self, guild: discord.Guild) -> None:
+        """ Runs the guild's due archive. The next one is saved and scheduled first, so
+            a crash mid-archive doesn't archive twice, and the archived channel is named
+            after it as it always has been """
+        server = servers.get(guild)
+        if server is None or server.next_archive_at is None:
+            return
+        due = server.next_archive_at
+        server.next_archive_at = server.next_archive_after(due, datetime.now(pytz.utc))
+        await db.set_next_archive_at(guild, server.next_archive_at)
+        await self.schedule_archive(guild)
+
+        if self.current_run is None:
+            self.current_run = ArchiveRun()
+        run = self.current_run
+        self.current_run_guilds += 1
+        timers.cancel(("archive_run",))
+        try:
+            async with self.semaphore:
+                started = time.monotonic()
                 try:
-                    await self.archive_general(guild=guild)
-                    ArchiveCog.log.info(
-                        str(now) + f": general archived in '{guild.name}' (id: {guild.id})")
+                    await asyncio.wait_for(self.archive_general(guild, run=run), ARCHIVE_TIMEOUT)
+                    run.record(guild, "archived", time.monotonic() - started)
+                except asyncio.TimeoutError:
+                    step = run.progress.get(guild.id)
+                    run.record(guild, "timed out", time.monotonic() - started,
+                               None if step is None else f"after: {step}")
+                    ArchiveCog.log.error(f"Archiving general timed out in '{guild.name}' (id: {guild.id})")
                 except Exception as ex:
-                    ArchiveCog.log.error(str(
-                        now) + f": there was an error archiving general in '{guild.name}' (id: {guild.id}): {str(ex)}")
-            await self.sleep_until_archive()
+                    run.record(guild, "failed", time.monotonic() - started, str(ex))
+                    ArchiveCog.log.error(f"There was an error archiving general in '{guild.name}' "
+                                         f"(id: {guild.id}): {ex}")
+        finally:
+            self.current_run_guilds -= 1
+            if self.current_run_guilds == 0:
+                run.finish()
+                # staggered guilds fire a minute apart, so wait for stragglers before
+                # closing the run
+                async def finish() -> None:
+                    self.finish_run(run)
+
+                timers.schedule(("archive_run",), datetime.now(pytz.utc) + ARCHIVE_RUN_GRACE, finish)
+
+    def finish_run(self, run: ArchiveRun) -> None:
+        """ Closes the scheduled archive run and reports it once, if no guild has
+            joined it since its last one finished """
+        if self.current_run is not run or self.current_run_guilds > 0:
+            return
+        for guild_id in run.results:
+            self.last_runs[guild_id] = run
+        self.current_run = None
+        ArchiveCog.log.info(str(run))
+
+    def start_export(self, channel: discord.TextChannel) -> asyncio.Task:
+        """ Exports the archived channel's history in the background, returns the
+            channel's export that's already running if there is one """
+        task = _running_exports.get(channel.id)
+        if task is not None and not task.done():
+            return task
+        task = asyncio.create_task(self.export_channel(channel))
+        _running_exports[channel.id] = task
+        task.add_done_callback(lambda _: ArchiveCog.forget_export(channel.id, task))
+        return task
+
+    @staticmethod
+    def forget_export(channel_id: int, task: asyncio.Task) -> None:
+        if _running_exports.get(channel_id) is task:
+            del _running_exports[channel_id]
 
-    async def sleep_until_archive(self) -> None:
-        """ Handles waiting for the next archive date """
-        now = datetime.now(tz=timezone("US/Eastern"))
-        then = db.get_next_archive_date()
-        wait_time = (then - now).total_seconds()
-        await asyncio.sleep(wait_time)
+    @staticmethod
+    def export_running(channel: discord.TextChannel) -> bool:
+        task = _running_exports.get(channel.id)
+        return task is not None and not task.done()
+
+    async def export_channel(self, channel: discord.TextChannel) -> None:
+        async with self.export_semaphore:
+            try:
+                manifest = await ChannelExporter(channel).run()
+                ArchiveCog.log.info(f"Exported {manifest['messages']:,} messages from '{channel.name}' "
+                                    f"in '{channel.guild.name}' to {manifest['path']}")
+                added = await asyncio.to_thread(self.search_index.add_export, manifest)
+                ArchiveCog.log.info(f"Indexed {added:,} new messages from '{channel.name}' "
+                                    f"in '{channel.guild.name}'")
+            except Exception as ex:
+                ArchiveCog.log.error(f"Exporting '{channel.name}' in '{channel.guild.name}' "
+                                     f"(id: {channel.id}) failed: {ex}")
+
+    @staticmethod
+    async def load_archive_frequencies() -> dict[int, int]:
+        """ Returns the archive frequency (in weeks) set in the ontology for each guild
+            that has one, by guild ID """
+        try:
+            osdk_guilds = await asyncio.to_thread(OsdkObjects.get_guilds)
+        except Exception as ex:
+            ArchiveCog.log.error(f"Couldn't load archive frequencies from the ontology: {ex}")
+            return {}
+        return {int(osdk_guild.server_id): int(osdk_guild.setting_archive_frequency)
+                for osdk_guild in osdk_guilds
+                if getattr(osdk_guild, "setting_archive_frequency", None)}
 
     async def get_channel_category(self, guild: discord.Guild, name: str,
                                    case_sens: bool) -> discord.CategoryChannel:
         """ Returns the discord.CategoryChannel of the first channel category 
             in the given guild that matches the given name """
-        def search_predicate(category: discord.CategoryChannel) -> bool:
-            return (category.name == name if case_sens else
-                    category.name.lower() == name.lower())
-
-        result = discord.utils.find(search_predicate, guild.categories)
+        result = ArchiveCog.channel_index(guild).find_category(name, case_sens)
         if result == None:
             result = await guild.create_category(name)
-            printlog((f"The channel category '{name}' doesn't exist in "
-                      f"'{guild.name}', so new category created "
-                      f"(id: {guild.id})"))
+            ArchiveCog.log.info((f"The channel category '{name}' doesn't exist in "
+                                 f"'{guild.name}', so new category created "
+                                 f"(id: {guild.id})"))
 
         return result
 
@@ -123,37 +387,16 @@ class ArchiveCog(Cog, name="Archive"):
         """ Returns the discord.TextChannel of the first text channel in the given guild 
             that matches the given name. Also, returns the channel category that the
             channel was in """
-        def search_category_predicate(category: discord.CategoryChannel) -> bool:
-            for channel in category.text_channels:
-                if case_sens:
-                    if channel.name == name:
-                        return True
-                else:
-                    if channel.name.lower() == name.lower():
-                        return True
-            return False
-
-        def search_channel_predicate(channel: discord.TextChannel) -> bool:
-            return (channel.name == name if case_sens else
-                    channel.name.lower() == name.lower())
-
-        category = discord.utils.find(
-            search_category_predicate, guild.categories)
-        if category != None:  # channel is in a category
-            channel = discord.utils.find(
-                search_channel_predicate, category.text_channels)
-            if channel == None:
-                raise Exception((f"Couldn't find a channel named '{name}' in the channel "
-                                 f"category '{category.name}' in '{guild.name} (id: {guild.id})'"))
-            return channel, category
-
-        # channel is not in a category
-        channel = discord.utils.find(
-            search_channel_predicate, guild.text_channels)
+        channel = ArchiveCog.channel_index(guild).find_text_channel(name, case_sens)
         if channel == None:
             raise Exception((f"Couldn't find a channel named '{name}' in "
                              f"'{guild.name} (id: {guild.id})'"))
 
-        return channel, None  # type: ignore
+        return channel, channel.category  # type: ignore
+
+    @staticmethod
+    def channel_index(guild: discord.Guild) -> ChannelIndex:
+        server = servers.get(guild)
+        return ChannelIndex(guild) if server is None else server.channels
 
     # endregion
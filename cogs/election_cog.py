@@ -1,12 +1,14 @@
 import asyncio
+import database as db
+from datetime import datetime
 import discord
 from discord.ext.commands import Cog
 from discord.ext import commands
 import discord.utils
-from models import Election
-from globals import elections
+from models import Election, Server
+from globals import elections, servers, timers
 import logging
-import random
+import pytz
 from osdk import OsdkActions, OsdkObjects
 
 
@@ -144,17 +146,21 @@ class ElectionCog(Cog, name="Election"):
         ElectionCog.log.info(
             f"'{server}' (id: {server.id}) election: cadence - {cadence_minutes}")
 
-        # Initiate election loop in the background
-        asyncio.create_task(ElectionCog.election_loop(
-            guild=server,
-            channel=channel,
-            members=members,
-            roles=roles,
-            cadence_minutes=cadence_minutes
-        ))
+        if not members:
+            raise ElectionCogException(
+                f"Must provide members for election: members={members}")
+        if not roles:
+            raise ElectionCogException(f"Must provide roles for election: roles={roles}")
+
+        # Persist the election, then let the shared timer queue run its draws
+        election = Election(servers.get(server) or Server(server), channel,
+                            [member.id for member in members], [role.id for role in roles],
+                            cadence_minutes)
+        await db.save_election(election.to_document())
+        self.schedule_draw(election)
 
         ElectionCog.log.info(
-            f"'{server.name}' (id: {server.id}) election: started election loop")
+            f"'{server.name}' (id: {server.id}) election: scheduled first draw at {election.next_time}")
 
         await channel.send("@everyone **Election has started!**\n"
                            "```"
@@ -166,34 +172,62 @@ class ElectionCog(Cog, name="Election"):
 
         return server, channel
 
-    async def election_loop(
-        guild: discord.Guild,
-        channel: discord.TextChannel,
-        members: list[discord.Member],
-        roles: list[discord.Role],
-        cadence_minutes: int
-    ):
-        """ Handles repeatedly sending out election result until finished """
-        if not members:
-            raise Exception(
-                f"Must provide members for election: members={members}")
-        if not roles:
-            raise Exception(f"Must provide roles for election: roles={roles}")
-
-        members_set = set(members)
-        roles_set = set(roles)
-
-        while members_set:
-            # Wait until next selection
-            await asyncio.sleep(cadence_minutes * 60)
-
-            # If we ran out of roles, reset the role pool
-            roles_set = set(roles) if not roles_set else roles_set
-
-            # Chose the member and the role to assign them
-            chosen_member = random.choice(tuple(members_set))
-            chosen_role = random.choice(tuple(roles_set))
-
+    async def resume_elections(self) -> None:
+        """ Picks up every election that was running when the bot last stopped """
+        for document in await db.get_running_elections():
+            guild = self.bot.get_guild(document["_id"])
+            channel = self.bot.get_channel(document["channel_id"])
+            if guild is None or not isinstance(channel, discord.TextChannel):
+                ElectionCog.log.error(f"Can't resume election in '{document['server_name']}' "
+                                      f"(id: {document['_id']}), its server or channel is gone")
+                await db.finish_election(document["_id"])
+                if guild is not None:
+                    await asyncio.to_thread(OsdkActions.stop_election, guild)
+                continue
+            election = Election.from_document(servers.get(guild) or Server(guild), channel, document)
+            self.schedule_draw(election)
+            ElectionCog.log.info(f"Resumed election: {election}")
+        timers.start()
+
+    def schedule_draw(self, election: Election) -> None:
+        guild = election.server.guild
+        elections[guild] = election
+
+        async def run_draw() -> None:
+            await self.draw(guild)
+
+        timers.schedule(("election", guild.id), election.next_time, run_draw)
+
+    async def draw(self, guild: discord.Guild) -> None:
+        """ Hands the next member their new role. The updated pools are saved before
+            anything is announced, so a restart never draws the same member twice """
+        election = elections.get(guild)
+        if election is None:
+            return
+        channel = election.channel
+
+        chosen_member: discord.Member | None = None
+        chosen_role: discord.Role | None = None
+        while chosen_member is None and not election.is_done() and election.roles:
+            member_id, role_id = election.draw()
+            chosen_member = guild.get_member(member_id)
+            chosen_role = guild.get_role(role_id)
+            if chosen_role is None:
+                # the role was deleted, stop handing it out and put the member back
+                election.forget_role(role_id)
+                election.members.append(member_id)
+                chosen_member = None
+            elif chosen_member is None:
+                # they left the server, give the role back to the pool and draw again
+                election.remaining_roles.append(role_id)
+        if not election.roles:
+            election.members.clear()
+        election.advance(datetime.now(pytz.utc))
+        await db.save_election(election.to_document())
+        if not election.is_done():
+            self.schedule_draw(election)
+
+        if chosen_member is not None and chosen_role is not None:
             # Notify result in channel
             await channel.send(f"@everyone **New Election Result**: {chosen_member.mention} is "
                                f"assigned the role of `{chosen_role.name}`")
@@ -202,7 +236,7 @@ class ElectionCog(Cog, name="Election"):
             # member may currently have
             try:
                 roles_to_remove = [
-                    role for role in chosen_member.roles if role in roles]
+                    role for role in chosen_member.roles if role.id in election.roles]
                 await chosen_member.remove_roles(*roles_to_remove)
 
                 # Grant the new chosen role to the member
@@ -212,17 +246,17 @@ class ElectionCog(Cog, name="Election"):
                                    f"`{chosen_member.display_name}`'s roles, you'll have to update "
                                    "their role manually")
 
-            # Remove selections from the members/roles pool
-            members_set.remove(chosen_member)
-            roles_set.remove(chosen_role)
-
             # OSDK update
-            OsdkActions.get_election_result(guild, chosen_member, chosen_role)
+            await asyncio.to_thread(OsdkActions.get_election_result, guild, chosen_member, chosen_role)
 
-        await channel.send("@everyone **Election complete!**")
+        if election.is_done():
+            # a new election may have been started while this one was announcing
+            if elections.get(guild) is election:
+                del elections[guild]
+            await channel.send("@everyone **Election complete!**")
 
-        # OSDK update
-        OsdkActions.stop_election(guild)
+            # OSDK update
+            await asyncio.to_thread(OsdkActions.stop_election, guild)
 
     # endregion
 
@@ -8,12 +8,13 @@ import database as db
 from datetime import timedelta
 from ai import LLMEngine, VisionEngine
 from typing import cast
-from models import Server, WSESession
-from globals import servers, live_wse_sessions
+from models import Server, VoiceSession, WSESession
+from globals import servers, live_wse_sessions, voice_sessions, wse_scheduler
 from utilities import printlog, send_message
 from osdk import OsdkActions
 import logging
 from api import run_api
+from database import sync as db_sync
 
 
 class EventsCog(Cog, name="Events"):
@@ -24,14 +25,32 @@ class EventsCog(Cog, name="Events"):
         self.bot = bot
         self.llm_engine = llm_engine
         self.vision_engine = vision_engine
+        self.stat_flush_task: asyncio.Task | None = None
+        self.threshold_flush_task: asyncio.Task | None = None
+        """ Early flush started when the stat buffer fills up (at most one at a time) """
+
+    def cog_unload(self) -> None:
+        if self.stat_flush_task is not None:
+            self.stat_flush_task.cancel()
+        asyncio.create_task(EventsCog.flush_user_stats())
 
     # region Events
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
         """ Event that runs once General Walarus is up and running """
-        EventsCog.initialize_servers(self.bot)
-        EventsCog.initialize_wse_sessions(self.bot)
+        # Blocking DB calls from other threads (shell, schedulers) run on this loop
+        db_sync.bind_loop(asyncio.get_running_loop())
+
+        await EventsCog.initialize_servers(self.bot)
+        await db.log_servers(self.bot.guilds)
+        await EventsCog.run_startup_maintenance()
+        await EventsCog.initialize_wse_sessions(self.bot)
+        await EventsCog.initialize_voice_sessions(self.bot)
+
+        # Periodically write buffered user stats to the DB
+        if self.stat_flush_task is None or self.stat_flush_task.done():
+            self.stat_flush_task = asyncio.create_task(self.stat_flush_loop())
 
         # Sync ontology in the background
         loop = asyncio.get_running_loop()
@@ -47,7 +66,8 @@ class EventsCog(Cog, name="Events"):
         asyncio.create_task(run_api(self.bot))
 
         # type: ignore
-        await self.bot.get_cog("Archive").repeat_archive(timedelta(weeks=2))
+        await self.bot.get_cog("Election").resume_elections()
+        await self.bot.get_cog("Archive").start_archive_schedule()
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message) -> None:
@@ -59,15 +79,17 @@ class EventsCog(Cog, name="Events"):
 
         bot_sent = message.author.bot
 
-        # updating user stats in DB
-        db.inc_user_stat(message.guild, cast(
+        # updating user stats (buffered, written to DB in bulk)
+        flush_needed = db.buffer_user_stat(message.guild, cast(
             discord.User, message.author), "sent_messages")
         for user in message.mentions:
             user_mentioned_self = user.id == message.author.id
             bot_mentioned_user = bot_sent
             if not user_mentioned_self and not bot_mentioned_user:
-                db.inc_user_stat(message.guild, cast(
-                    discord.User, user), "mentioned")
+                flush_needed = db.buffer_user_stat(message.guild, cast(
+                    discord.User, user), "mentioned") or flush_needed
+        if flush_needed and (self.threshold_flush_task is None or self.threshold_flush_task.done()):
+            self.threshold_flush_task = asyncio.create_task(EventsCog.flush_user_stats())
 
         if not bot_sent:
             # Walarus responds if mentioned
@@ -91,8 +113,9 @@ class EventsCog(Cog, name="Events"):
             Servers information is added to the database """
         printlog(
             f"General Walarus joined guild '{guild.name}' (id: {guild.id})")
-        servers[guild] = Server(guild)
-        db.log_server(guild)
+        servers[guild] = await Server.load(guild)
+        await db.log_server(guild)
+        await self.bot.get_cog("Archive").schedule_archive(guild)  # type: ignore
 
         # OSDK update
         OsdkActions.sync_ontology(self.bot.guilds)
@@ -102,10 +125,11 @@ class EventsCog(Cog, name="Events"):
         """ Event that runs when General Walarus gets removed from a server.\n
             Server information is deleted from database """
         del servers[guild]
+        self.bot.get_cog("Archive").unschedule_archive(guild)  # type: ignore
         printlog(
             f"General Walarus has been removed from guild '{guild.name}' (id: {guild.id})")
         printlog(
-            f"{db.remove_discord_server(guild)} documents removed from database")
+            f"{await db.remove_discord_server(guild)} documents removed from database")
 
         # OSDK update
         OsdkActions.sync_ontology(self.bot.guilds)
@@ -114,7 +138,7 @@ class EventsCog(Cog, name="Events"):
     async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
         """ Event that runs when a server's information gets updated.\n
             Server information gets updated in the database """
-        db.log_server(after)
+        await db.log_server(after)
         printlog(f"Server {before.id} was updated")
 
         # OSDK update
@@ -125,14 +149,14 @@ class EventsCog(Cog, name="Events"):
         """ Event that runs when a user joins a guild """
         guild = member.guild
 
-        if not db.create_user(guild, member):
+        if not await db.create_user(guild, member):
             EventsCog.log.error("Failed to create user in MongoDB")
 
         # the following code is only if there is an active Walarus Stock Exchange
         if live_wse_sessions.get(guild) is not None:
             MAGIC_USER = live_wse_sessions[guild].user_id
             if member.id == MAGIC_USER:
-                db.set_current_wse_price(member.guild, 0)
+                await db.set_current_wse_price(member.guild, 0)
                 general: discord.TextChannel | None
                 general = utils.find(lambda channel: channel.name ==
                                      "general", guild.text_channels)
@@ -147,7 +171,7 @@ class EventsCog(Cog, name="Events"):
         """ Event that runs when a user is removed from a guild """
         guild = member.guild
 
-        if not db.remove_user(guild, member):
+        if not await db.remove_user(guild, member):
             EventsCog.log.error("Failed to remove user in MongoDB")
 
         # OSDK update
@@ -178,7 +202,7 @@ class EventsCog(Cog, name="Events"):
         """ Event that runs when a user changes voice state (join/leaves VC, gets muted/unmuted, 
             gets deafened/undeafened, etc.) """
         guild: discord.Guild = member.guild
-        self.db_update_voice(member, guild, before, after)
+        await self.db_update_voice(member, guild, before, after)
 
         if self.bot.user and member.id == self.bot.user.id:
             if before.channel and not after.channel:
@@ -196,6 +220,8 @@ class EventsCog(Cog, name="Events"):
         """ Event that runs when a channel's information gets updated """
         EventsCog.log.info(
             f"Channel '{after.name}' in '{after.guild.name}' was updated")
+        if after.guild in servers:
+            servers[after.guild].channels.update(before, after)
 
         # OSDK update
         if isinstance(before, discord.TextChannel) and isinstance(after, discord.TextChannel):
@@ -207,6 +233,8 @@ class EventsCog(Cog, name="Events"):
     async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
         EventsCog.log.info(
             f"Channel '{channel.name}' in '{channel.guild.name}' was created")
+        if channel.guild in servers:
+            servers[channel.guild].channels.add(channel)
 
         # OSDK update
         if isinstance(channel, discord.TextChannel):
@@ -218,6 +246,8 @@ class EventsCog(Cog, name="Events"):
     async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
         EventsCog.log.info(
             f"Channel '{channel.name}' in '{channel.guild.name}' was deleted")
+        if channel.guild in servers:
+            servers[channel.guild].channels.remove(channel)
 
         # OSDK update
         if isinstance(channel, discord.TextChannel):
@@ -229,65 +259,117 @@ class EventsCog(Cog, name="Events"):
 
     # region Helper Functions
 
-    def db_update_voice(
+    async def db_update_voice(
         self,
         member: discord.Member,
         guild: discord.Guild,
         before: discord.VoiceState,
         after: discord.VoiceState
     ) -> None:
-        """ Analyzes before and after voice state and updates user voice status in database """
+        """ Analyzes before and after voice state, updates the in-memory voice sessions
+            and writes any VC time accrued to the database in one go """
+        if before.channel == after.channel:
+            return  # muted/deafened/etc., nothing to track
+
         now: datetime = datetime.now()
-        if before.channel == None and after.channel != None:
-            # user joins a voice channel
-            db.update_user_stats(
-                guild, member, last_connected_to_vc=now, connected_to_vc=True)
-            vc_members: list = after.channel.members
-            non_bot_count: int = 0
-            for vc_member in vc_members:
-                if not vc_member.bot:
-                    non_bot_count += 1
-            vc_timer: bool = non_bot_count > 1
-            for vc_member in vc_members:
-                db.update_user_stats(guild, vc_member, vc_timer=vc_timer)
-        elif before.channel != None and after.channel == None:
-            # user leaves a voice channel
-            field_name: str = "last_connected_to_vc"
-            connected_time: datetime = cast(dict, db.get_user_stat(
-                guild, member.id, field_name))[field_name]
-            session_length: int = (now - connected_time).seconds
-            vc_members: list = before.channel.members
-            vc_timer: bool = cast(dict, db.get_user_stat(
-                guild, member.id, "vc_timer"))["vc_timer"]
-            if len(vc_members) == 1:  # just one more person left in voice channel
-                # stop everyone's vc timer and update time in db
-                for vc_member in vc_members:
-                    update_time: bool = cast(dict, db.get_user_stat(
-                        guild, vc_member.id, "vc_timer"))["vc_timer"]
-                    if update_time:
-                        db.inc_user_stat(guild, vc_member,
-                                         "time_in_vc", session_length)
-                        db.update_user_stats(guild, vc_member, vc_timer=False)
-            if vc_timer:  # update time of the person who's leaving
-                db.inc_user_stat(guild, member, "time_in_vc", session_length)
-            db.update_user_stats(
-                guild, member, connected_to_vc=False, vc_timer=False)
+        timed_since: dict[discord.Member, datetime] = {}
+        connected: dict[discord.Member, bool] = {}
+
+        if before.channel is not None:
+            # user leaves (or moves out of) a voice channel
+            session = voice_sessions.get(before.channel.id)
+            if session is not None:
+                timed_since = session.leave(member, now)
+                if session.is_empty():
+                    del voice_sessions[before.channel.id]
+            connected[member] = False
+
+        if after.channel is not None:
+            # user joins (or moves into) a voice channel
+            session = voice_sessions.setdefault(
+                after.channel.id, VoiceSession(after.channel))
+            session.join(member, now)
+            connected[member] = True
+
+        await db.update_voice_stats(guild, now, timed_since, connected)
+
+    async def stat_flush_loop(self) -> None:
+        """ Handles flushing the user stat buffer on a timer """
+        while True:
+            await asyncio.sleep(db.FLUSH_INTERVAL)
+            await EventsCog.flush_user_stats()
+
+    @staticmethod
+    async def flush_user_stats() -> None:
+        """ Writes buffered user stats to the DB, logging rather than raising on failure """
+        try:
+            await db.flush_user_stats()
+        except Exception as ex:
+            EventsCog.log.error(f"Failed to flush user stats: {ex}")
 
     @staticmethod
-    def initialize_servers(bot: discord.Bot):
+    async def run_startup_maintenance():
+        """ Runs the DB upkeep startup relies on. A step that fails (e.g. missing
+            privileges) is logged and skipped so the rest of startup still runs """
+        for step in (db.ensure_indexes, db.backfill_user_scores, db.seed_wse_positions,
+                     db.migrate_wse_price_log, db.rebuild_wse_candles):
+            try:
+                await step()
+            except Exception:
+                EventsCog.log.exception(f"Startup step '{step.__name__}' failed, continuing")
+
+    @staticmethod
+    async def initialize_servers(bot: discord.Bot):
+        servers.update(await Server.load_all(bot.guilds))
+
+    @staticmethod
+    async def initialize_voice_sessions(bot: discord.Bot):
+        """ Reconciles the voice sessions with whoever is connected to VC now. on_ready
+            also fires on reconnects, so members still connected keep their running
+            segments, ones who left while events weren't coming in are credited up to
+            now, and anyone not tracked yet joins """
+        now: datetime = datetime.now()
         for guild in bot.guilds:
-            servers[guild] = Server(guild)
+            timed_since: dict[discord.Member, datetime] = {}
+            connected: dict[discord.Member, bool] = {}
+            for channel in guild.voice_channels:
+                session = voice_sessions.get(channel.id)
+                if session is None:
+                    continue
+                present = {member.id for member in channel.members}
+                for member in [member for member_id, member in session.members.items()
+                               if member_id not in present]:
+                    timed_since.update(session.leave(member, now))
+                    connected[member] = False
+                if session.is_empty():
+                    del voice_sessions[channel.id]
+            for channel in guild.voice_channels:
+                if not channel.members:
+                    continue
+                session = voice_sessions.setdefault(channel.id, VoiceSession(channel))
+                for member in channel.members:
+                    if member.id not in session.members:
+                        session.join(member, now)
+                        connected[member] = True
+            if timed_since or connected:
+                try:
+                    await db.update_voice_stats(guild, now, timed_since, connected)
+                except Exception:
+                    EventsCog.log.exception(f"Failed to save VC time for '{guild.name}' (id: {guild.id})")
 
     @staticmethod
-    def initialize_wse_sessions(bot: discord.Bot):
-        db_sessions = db.get_active_wse_servers()
+    async def initialize_wse_sessions(bot: discord.Bot):
+        db_sessions = await db.get_active_wse_servers()
         for item in db_sessions:
             id = item["_id"]
             user_id_to_track = item["wse_user_id"]
             guild = utils.find(lambda guild: guild.id == id, bot.guilds)
             if guild is None:
                 raise Exception("guild is None")
+            await db.warm_wse_price(guild)
             live_wse_sessions[guild] = WSESession(
                 guild, user_id_to_track, "0 9 * * *")
+            wse_scheduler.add(live_wse_sessions[guild])
+        wse_scheduler.start(asyncio.get_running_loop())
 
     # endregion
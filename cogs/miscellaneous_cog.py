@@ -75,7 +75,7 @@ class MiscellaneousCog(Cog, name="Miscellaneous"):
         if ctx.guild is None:
             raise Exception("ctx.guild is None")
         if ctx.author.id == ctx.guild.owner_id:
-            created_new = db.log_server(ctx.guild)
+            created_new = await db.log_server(ctx.guild)
             if created_new:
                 await ctx.send("Logged this server into the database")
             else:
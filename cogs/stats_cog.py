@@ -1,8 +1,12 @@
+from backfill import HistoryBackfill
+from datetime import datetime, timedelta
 import discord
 from discord.ext.commands import Cog
 from discord.ext import commands
 import database as db
+from globals import servers
 from models import TimeSpan
+from pytz import timezone
 from typing import cast
 from utilities import printlog
 import io
@@ -10,6 +14,8 @@ import io
 
 class StatisticsCog(Cog, name="Statistics"):
     """ Class containing General Walarus' statistics commands """
+    PAGE_SIZE = 10
+    """ Number of users on each page of the leaderboard """
 
     # region Commands
 
@@ -20,7 +26,7 @@ class StatisticsCog(Cog, name="Statistics"):
             guild = ctx.guild
             user = cast(discord.User, ctx.author) if user is None else user
             if guild != None:
-                query = cast(dict, db.get_user_stat(
+                query = cast(dict, await db.get_user_stat(
                     guild, user.id, "sent_messages"))
                 messages = int(query["sent_messages"])
                 if user.id == ctx.author.id:
@@ -38,42 +44,175 @@ class StatisticsCog(Cog, name="Statistics"):
             guild = ctx.guild
             user = cast(discord.User, ctx.author) if user is None else user
             if guild != None:
-                query = cast(dict, db.get_user_stat(
+                query = cast(dict, await db.get_user_stat(
                     guild, user.id, "time_in_vc"))
                 seconds = int(query["time_in_vc"])
-                time: TimeSpan = TimeSpan(seconds)
                 msg = f"You've spent" if user.id == ctx.author.id else f"{user.name} has spent"
-                if time.days() > 0:
-                    msg += (f" {time.days()} {time.days_unit()}, {time.hours()} {time.hours_unit()}, "
-                            f"{time.minutes()} {time.minutes_unit()}, and {time.seconds()} "
-                            f"{time.seconds_unit()} in voice channel")
-                elif time.hours() > 0:
-                    msg += (f" {time.hours()} {time.hours_unit()}, {time.minutes()} "
-                            f"{time.minutes_unit()}, and {time.seconds()} "
-                            f"{time.seconds_unit()} in voice channel")
-                elif time.minutes() > 0:
-                    msg += (f" {time.minutes()} {time.minutes_unit()}, and {time.seconds()} "
-                            f"{time.seconds_unit()} in voice channel")
-                else:
-                    msg += f" {time.seconds()} {time.seconds_unit()} in voice channel"
+                msg += f" {StatisticsCog.time_phrase(TimeSpan(seconds))} in voice channel"
                 await ctx.send(msg)
         except Exception as e:
             printlog(str(e))
             await ctx.send("I pooped my pants...try again")
 
     @commands.command(name="showstats", aliases=["leaderboard"])
-    async def show_stats(self, ctx: commands.Context):
+    async def show_stats(self, ctx: commands.Context, page: int = 1):
+        """ Command that sends a page of the server stats leaderboard, plus your rank """
         if ctx.guild == None:
             await ctx.send("Aw poop nuggets, I sharted myself...")
             return
-        leaderboard: list = db.get_user_stats(ctx.guild)
-
-        sort_key = lambda user: user["sent_messages"] + user["time_in_vc"] + user["mentioned"]
-        leaderboard.sort(key=sort_key, reverse=True)
-        
-        message = "SERVER STATS LEADERBOARD\n\n"
-        for user in leaderboard:
-            username = user["user_name"]
+        page = max(page, 1)
+        leaderboard: list = await db.get_leaderboard(
+            ctx.guild, page=page - 1, page_size=StatisticsCog.PAGE_SIZE)
+        rank = await db.get_user_rank(ctx.guild, ctx.author.id)
+        title = f"SERVER STATS LEADERBOARD (PAGE {page})"
+        if rank is not None:
+            title += f"\nYour rank: #{rank:,}"
+        await StatisticsCog.send_leaderboard(
+            ctx, leaderboard, title, first_rank=(page - 1) * StatisticsCog.PAGE_SIZE + 1)
+
+    @commands.command(name="recentmessages", aliases=["messagesin"])
+    async def recent_messages(self, ctx: commands.Context, window: str = "today",
+                              user: discord.User = None) -> None:  # type: ignore
+        """ Command that sends back how many messages user has sent in a recent window
+            (today, day, week, month, or e.g. 12h/3d) """
+        try:
+            guild = ctx.guild
+            user = cast(discord.User, ctx.author) if user is None else user
+            if guild != None:
+                start, end, label = StatisticsCog.parse_window(guild, window)
+                stats = await db.get_user_window_stat(guild, user.id, start, end)
+                messages = stats["sent_messages"]
+                if user.id == ctx.author.id:
+                    await ctx.send(f"You've sent {messages:,} messages {label}")
+                else:
+                    await ctx.send(f"{user.name} has sent {messages:,} messages {label}")
+        except ValueError:
+            await ctx.send(f"'{window}' isn't a window I know (try today, day, week, month, 12h, 3d)")
+        except Exception as e:
+            printlog(str(e))
+            await ctx.send("I pooped my pants...try again")
+
+    @commands.command(name="recentvctime", aliases=["vctimein"])
+    async def recent_vctime(self, ctx: commands.Context, window: str = "today",
+                            user: discord.User = None) -> None:  # type: ignore
+        """ Command that sends back how much time user has spent in voice channel in a
+            recent window (today, day, week, month, or e.g. 12h/3d) """
+        try:
+            guild = ctx.guild
+            user = cast(discord.User, ctx.author) if user is None else user
+            if guild != None:
+                start, end, label = StatisticsCog.parse_window(guild, window)
+                stats = await db.get_user_window_stat(guild, user.id, start, end)
+                msg = f"You've spent" if user.id == ctx.author.id else f"{user.name} has spent"
+                msg += (f" {StatisticsCog.time_phrase(TimeSpan(stats['time_in_vc']))} "
+                        f"in voice channel {label}")
+                await ctx.send(msg)
+        except ValueError:
+            await ctx.send(f"'{window}' isn't a window I know (try today, day, week, month, 12h, 3d)")
+        except Exception as e:
+            printlog(str(e))
+            await ctx.send("I pooped my pants...try again")
+
+    @commands.command(name="recentstats", aliases=["leaderboardin"])
+    async def recent_stats(self, ctx: commands.Context, window: str = "week"):
+        """ Command that sends the stats leaderboard for a recent window
+            (today, day, week, month, or e.g. 12h/3d) """
+        if ctx.guild == None:
+            await ctx.send("Aw poop nuggets, I sharted myself...")
+            return
+        try:
+            start, end, label = StatisticsCog.parse_window(ctx.guild, window)
+        except ValueError:
+            await ctx.send(f"'{window}' isn't a window I know (try today, day, week, month, 12h, 3d)")
+            return
+        leaderboard: list = await db.get_window_stats(ctx.guild, start, end)
+        await StatisticsCog.send_leaderboard(
+            ctx, leaderboard, f"SERVER STATS LEADERBOARD ({label.upper()})")
+
+    @commands.command(name="backfill", aliases=["backfillstats"])
+    async def backfill(self, ctx: commands.Context, after: str, before: str) -> None:
+        """ Command that counts message stats from channel history between two dates
+            (YYYY-MM-DD) the bot wasn't running for, e.g. to cover an outage """
+        if ctx.guild is None:
+            raise Exception("ctx.guild is None")
+        if ctx.author.id != ctx.guild.owner_id:
+            await ctx.send("Only the owner can use this command")
+            return
+        try:
+            after_dt = datetime.strptime(after, "%Y-%m-%d")
+            before_dt = datetime.strptime(before, "%Y-%m-%d")
+        except ValueError:
+            await ctx.send("Dates need to look like YYYY-MM-DD")
+            return
+
+        try:
+            engine = HistoryBackfill([ctx.guild], after=after_dt, before=before_dt)
+        except ValueError:
+            await ctx.send("The window needs to end after it starts, and before I came online")
+            return
+        status = await ctx.send(f"```{engine}```")
+
+        async def show_progress(engine: HistoryBackfill) -> None:
+            await status.edit(content=f"```{engine}```")
+
+        await engine.run(on_progress=show_progress)
+
+    # endregion
+
+    # region Helper Functions
+
+    @staticmethod
+    def parse_window(guild: discord.Guild, window: str) -> tuple[datetime, datetime, str]:
+        """ Turns a window name into its (start, end, description), raises ValueError
+            if the window isn't recognized """
+        server = servers.get(guild)
+        now = datetime.now(tz=timezone(server.timezone if server else "US/Eastern"))
+        window = window.lower()
+        if window == "today":
+            return now.replace(hour=0, minute=0, second=0, microsecond=0), now, "today"
+        if window in ("day", "week", "month"):
+            days = {"day": 1, "week": 7, "month": 30}[window]
+            return now - timedelta(days=days), now, f"in the last {window}"
+        if len(window) > 1 and window[-1] in ("h", "d") and window[:-1].isdigit():
+            amount = int(window[:-1])
+            if amount > 0:
+                unit = "hours" if window[-1] == "h" else "days"
+                return now - timedelta(**{unit: amount}), now, f"in the last {amount} {unit}"
+        raise ValueError(f"Unknown window '{window}'")
+
+    @staticmethod
+    def time_phrase(time: TimeSpan) -> str:
+        """ Formats a TimeSpan, leaving out leading units that are zero """
+        if time.days() > 0:
+            return (f"{time.days()} {time.days_unit()}, {time.hours()} {time.hours_unit()}, "
+                    f"{time.minutes()} {time.minutes_unit()}, and {time.seconds()} "
+                    f"{time.seconds_unit()}")
+        elif time.hours() > 0:
+            return (f"{time.hours()} {time.hours_unit()}, {time.minutes()} "
+                    f"{time.minutes_unit()}, and {time.seconds()} "
+                    f"{time.seconds_unit()}")
+        elif time.minutes() > 0:
+            return (f"{time.minutes()} {time.minutes_unit()}, and {time.seconds()} "
+                    f"{time.seconds_unit()}")
+        return f"{time.seconds()} {time.seconds_unit()}"
+
+    @staticmethod
+    async def send_leaderboard(ctx: commands.Context, leaderboard: list, title: str,
+                               first_rank: int | None = None):
+        """ Sends the given users as a leaderboard. If first_rank is given the users are
+            assumed to already be ranked, otherwise they get sorted by score here """
+        if first_rank is None:
+            sort_key = lambda user: user["sent_messages"] + user["time_in_vc"] + user["mentioned"]
+            leaderboard.sort(key=sort_key, reverse=True)
+            first_rank = 1
+
+        if not leaderboard:
+            await ctx.send(f"```{title}\n\nNobody's on this page```")
+            return
+
+        message = f"{title}\n\n"
+        for rank, user in enumerate(leaderboard, start=first_rank):
+            username = f"#{rank} {user['user_name']}"
             mentioned = user["mentioned"]
             mentioned_units = "time" if mentioned == 1 else "times"
             sent_messages = user["sent_messages"]
@@ -1,19 +1,26 @@
 import discord
-from discord import utils
 from discord.ext.commands import Cog
 from discord.ext import commands
+import asyncio
+import charts
 import database as db
+from datetime import datetime
 from models import WSESession
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
-import os
-from globals import live_wse_sessions
+import io
+from globals import live_wse_sessions, wse_scheduler
+import simulation
+
+MAX_SIMULATED_DAYS = 3650
+MAX_SIMULATED_PATHS = 100000
 
 
 class WSECog(Cog, name="Walarus Stock Exchange"):
     """ Class containing commands pertaining to Walarus Stock Exchange """
 
+    def __init__(self) -> None:
+        self.chart_cache: dict[int, tuple[datetime, bytes]] = {}
+        """ Last rendered price graph PNG of each guild, with the price timestamp it's up to date with """
+
     # region Commands
 
     @commands.command(name="wse", aliases=["currentstockprice", "currentprice", "price"])
@@ -22,16 +29,18 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         guild: discord.Guild | None = ctx.guild  # type: ignore
         if guild is None:
             raise Exception("wse_details(): guild is None")
-        wse_status = db.get_wse_status(guild)
+        wse_status = await db.get_wse_status(guild)
 
         if not wse_status:
             await ctx.send("The Walarus Stock Exchange is not currently open")
             return
 
-        price = db.get_current_wse_price(guild)
-        job = live_wse_sessions[guild].job
+        price = await db.get_current_wse_price(guild)
+        session = live_wse_sessions.get(guild)
+        job = None if session is None else session.job
+        next_update = "Not scheduled" if job is None else job.next_run_time
         await ctx.send(f"**Price**: ${round(price, 2):,.2f}\n"
-                       f"**Next Price Update**: {job.next_run_time}\n"
+                       f"**Next Price Update**: {next_update}\n"
                        f"**Stock Price Graph**:")
         await self.__show_graph(ctx)
 
@@ -41,22 +50,18 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         guild: discord.Guild | None = ctx.guild  # type: ignore
         if guild is None:
             raise Exception("wse_buy(): guild is None")
-        wse_status = db.get_wse_status(guild)
+        wse_status = await db.get_wse_status(guild)
 
         if not wse_status:
             await ctx.send("The Walarus Stock Exchange is not currently open")
             return
 
         author: discord.Member = ctx.author  # type: ignore
-        last_transaction = db.get_last_transaction(author)["action"]
-
-        if last_transaction == "buy":
+        curr_price = await db.get_current_wse_price(guild)
+        if not await db.set_transaction(member=author, curr_price=curr_price, transaction_type="buy"):
             await ctx.send("You are already bought into the WSE!")
             return
 
-        curr_price = db.get_current_wse_price(guild)
-        db.set_transaction(
-            member=author, curr_price=curr_price, transaction_type="buy")
         await ctx.send(f"{ctx.author.name} just bought into the Walarus Stock Exchange for "
                        f"${round(curr_price, 2):,.2f}")
 
@@ -66,22 +71,18 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         guild: discord.Guild | None = ctx.guild  # type: ignore
         if guild is None:
             raise Exception("wse_sell(): guild is None")
-        wse_status = db.get_wse_status(guild)
+        wse_status = await db.get_wse_status(guild)
 
         if not wse_status:
             await ctx.send("The Walarus Stock Exchange is not currently open")
             return
 
         author: discord.Member = ctx.author  # type: ignore
-        last_transaction = db.get_last_transaction(author)["action"]
-
-        if last_transaction == "sell":
+        curr_price = await db.get_current_wse_price(guild)
+        if not await db.set_transaction(member=author, curr_price=curr_price, transaction_type="sell"):
             await ctx.send("You haven't bought into the WSE yet!")
             return
 
-        curr_price = db.get_current_wse_price(guild)
-        db.set_transaction(
-            member=author, curr_price=curr_price, transaction_type="sell")
         await ctx.send(f"{ctx.author.name} just sold share in the Walarus Stock Exchange for "
                        f"${round(curr_price, 2):,.2f}")
 
@@ -95,20 +96,21 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         guild: discord.Guild | None = ctx.guild  # type: ignore
         if guild is None:
             raise Exception("wse_start(): guild is None")
-        wse_status = db.get_wse_status(guild)
+        wse_status = await db.get_wse_status(guild)
 
         if wse_status:
             await ctx.send("The Walarus Stock Exchange is already open!")
             return
 
         OPENING_PRICE = 1.00
-        db.set_wse_status(guild, status=True, user_id=user_id)
-        db.set_current_wse_price(guild, OPENING_PRICE)
-        price = db.get_current_wse_price(guild)
+        await db.set_wse_status(guild, status=True, user_id=user_id)
+        await db.set_current_wse_price(guild, OPENING_PRICE)
+        price = await db.get_current_wse_price(guild)
         await ctx.send("@everyone The Walarus Stock Exchange is now open for business at "
                        f"price of ${round(price, 2):,.2f}!")
 
         live_wse_sessions[guild] = WSESession(guild, user_id, "0 9 * * *")
+        wse_scheduler.add(live_wse_sessions[guild])
 
     @commands.command(name="wseclose", aliases=["wsestop", "wseend"])
     async def wse_end(self, ctx: commands.Context):
@@ -120,15 +122,16 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         guild: discord.Guild | None = ctx.guild  # type: ignore
         if guild is None:
             raise Exception("wse_end(): guild is None")
-        wse_status = db.get_wse_status(guild)
+        wse_status = await db.get_wse_status(guild)
 
         if not wse_status:
             await ctx.send("The Walarus Stock Exchange is not currently open")
             return
 
-        db.set_wse_status(guild, status=False)
+        await db.set_wse_status(guild, status=False)
         await ctx.send("@everyone The Walarus Stock Exchange is now closed")
 
+        wse_scheduler.remove(guild)
         del live_wse_sessions[guild]
 
     @commands.command(name="lasttransaction")
@@ -136,16 +139,16 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         """ View details about your last WSE transaction """
         if member is None:
             member = ctx.author
-        transaction = db.get_last_transaction(member)
-        if transaction is None:
+        position = await db.get_wse_position(member)
+        if position is None:
             who = "You haven't" if member.id == ctx.author.id else f"{member.name} hasn't"
             await ctx.send(f"{who} made any transactions yet. Try the 'wsebuy' or 'wsesell' commands.")
             return
         who = "your" if member.id == ctx.author.id else f"{member.name}'s"
         await ctx.send(f"Here are the details of {who} last transaction:\n"
-                       f"\t**Timestamp**: {transaction['timestamp']}\n"
-                       f"\t**Transaction Type**: {transaction['action']}\n"
-                       f"\t**Price**: ${round(transaction['price'], 2):,.2f}")
+                       f"\t**Timestamp**: {position['last_timestamp']}\n"
+                       f"\t**Transaction Type**: {position['last_action']}\n"
+                       f"\t**Price**: ${round(position['last_price'], 2):,.2f}")
 
     @commands.command(name="wseportfolio", aliases=["myportfolio", "seeportfolio", "portfolio"])
     async def wse_portfolio(self, ctx: commands.Context, member: discord.Member | None = None):
@@ -153,10 +156,15 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
         if member is None:
             member = ctx.author
 
-        transaction = db.get_last_transaction(member)
-        curr_price = db.get_current_wse_price(ctx.guild)
-        stock = curr_price if transaction["action"] == "buy" else 0
-        cash = transaction["cash_value"]
+        position = await db.get_wse_position(member)
+        if position is None:
+            who = "You haven't" if member.id == ctx.author.id else f"{member.name} hasn't"
+            await ctx.send(f"{who} bought into the WSE yet. Try the 'wsebuy' command.")
+            return
+
+        curr_price = await db.get_current_wse_price(ctx.guild)
+        stock = curr_price if position["holding"] else 0
+        cash = position["cash_value"]
         total = stock + cash
         who = "Your" if member.id == ctx.author.id else f"{member.name}'s"
 
@@ -167,37 +175,15 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
                        f"\tOverall Net: ${round(total - 1, 2):,.2f}```")
 
     @commands.command(name="wseleaderboard")
-    async def wse_leaderboard(self, ctx: commands.Context):
-        """ View the WSE leaderboard """
-        transactions = db.get_transactions(guild=ctx.guild)
-        participants = np.unique([transaction["user_id"]
-                                 for transaction in transactions])
-        curr_price = db.get_current_wse_price(ctx.guild)
-        portfolios = []
-
-        for participant in participants:
-            member = utils.find(
-                lambda m: m.id == participant, ctx.guild.members)
-            last_transaction = db.get_last_transaction(member)
-            name = last_transaction["user_name"]
-            stock = curr_price if last_transaction["action"] == "buy" else 0
-            cash = last_transaction["cash_value"]
-            portfolio = {
-                "name": name,
-                "stock_value": stock,
-                "cash_value": cash,
-                "total": stock + cash,
-                "net": (stock + cash) - 1
-            }
-            portfolios.append((last_transaction, portfolio))
+    async def wse_leaderboard(self, ctx: commands.Context, page: int | None = None):
+        """ View the WSE leaderboard (optionally just one page of it) """
+        curr_price = await db.get_current_wse_price(ctx.guild)
+        portfolios = await db.get_wse_leaderboard(
+            ctx.guild, curr_price, page=None if page is None else max(page, 1) - 1)
 
         message = "```WALARUS STOCK EXCHANGE LEADERBOARD\n\n"
-        portfolios = sorted(
-            portfolios, key=lambda p: (-p[1]["total"], p[1]["name"]))
-        for item in portfolios:
-            last_transaction = item[0]
-            portfolio = item[1]
-            message += (f"{last_transaction['user_name']}\n"
+        for portfolio in portfolios:
+            message += (f"{portfolio['user_name']}\n"
                         f"\tStock Value: ${round(portfolio['stock_value'], 2):,.2f}\n"
                         f"\tCash Value: ${round(portfolio['cash_value'], 2):,.2f}\n"
                         f"\tTotal Portfolio Value: ${round(portfolio['total'], 2):,.2f}\n"
@@ -206,6 +192,31 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
 
         await ctx.send(message)
 
+    @commands.command(name="wsesimulate", aliases=["wsesim"])
+    async def wse_simulate(self, ctx: commands.Context, days: int = 365, paths: int = 10000):
+        """ Simulate where the WSE price could go from here over the given number of days """
+        if ctx.guild is None:
+            raise Exception("wse_simulate(): guild is None")
+        if ctx.author.id != ctx.guild.owner_id:
+            await ctx.send("Only the server owner can use this command")
+            return
+        if not 1 <= days <= MAX_SIMULATED_DAYS or not 1 <= paths <= MAX_SIMULATED_PATHS:
+            await ctx.send(f"Simulations can cover up to {MAX_SIMULATED_DAYS:,} days "
+                           f"and {MAX_SIMULATED_PATHS:,} paths")
+            return
+
+        wse_status = await db.get_wse_status(ctx.guild)
+        start_price = await db.get_current_wse_price(ctx.guild) if wse_status else 1.00
+        bands = await asyncio.to_thread(simulation.simulate_wse_percentiles,
+                                        start_price, days, paths)
+        png = await charts.render(charts.render_fan_chart,
+                                  list(simulation.DEFAULT_PERCENTILES), bands.tolist())
+        final = dict(zip(simulation.DEFAULT_PERCENTILES, bands[:, -1]))
+        await ctx.send(f"Simulated {paths:,} paths over {days:,} days from ${round(start_price, 2):,.2f}. "
+                       f"Median price at the end: ${final[50]:,.2f} "
+                       f"(90% between ${final[5]:,.2f} and ${final[95]:,.2f})",
+                       file=discord.File(io.BytesIO(png), filename="simulation.png"))
+
     # @commands.command(name="wsetest")
     # async def wse_test(self, ctx: commands.Context, member: discord.Member | None):
     #     """ Test command for the Walarus Stock Exchange """
@@ -216,21 +227,22 @@ class WSECog(Cog, name="Walarus Stock Exchange"):
     # region Helper Functions
 
     async def __show_graph(self, ctx: commands.Context):
-        matplotlib.use('Agg')
-        timestamps, prices = db.get_prices(ctx.guild)
-
-        fig, ax = plt.subplots()
-        fig.set_figwidth(15)
-        ax.set_ylabel("Price", labelpad=25)
-        ax.yaxis.set_major_formatter('${x:1.2f}')
-        ax.set_xlabel("Date", labelpad=25)
-        ax.tick_params(axis='x', labelrotation=90)
-        ax.plot(timestamps, prices, marker="o")
-
-        image_name = "prices.jpg"
-        plt.savefig(image_name, bbox_inches='tight')
-        plt.close()
-        await ctx.send(file=discord.File(image_name))
-        os.remove(image_name)
+        guild: discord.Guild = ctx.guild  # type: ignore
+        _, latest = await db.get_current_wse_quote(guild)
+        cached = self.chart_cache.get(guild.id)
+        if cached is not None and cached[0] == latest:
+            png = cached[1]
+        else:
+            resolution, history = await db.get_price_history(guild)
+            timestamps = [str(candle["bucket"].date()) for candle in history]
+            prices = [candle["close"] for candle in history]
+            if resolution == "tick":
+                png = await charts.render(charts.render_price_chart, timestamps, prices)
+            else:
+                png = await charts.render(charts.render_price_chart, timestamps, prices,
+                                          [candle["low"] for candle in history],
+                                          [candle["high"] for candle in history])
+            self.chart_cache[guild.id] = (latest, png)
+        await ctx.send(file=discord.File(io.BytesIO(png), filename="prices.png"))
 
     # endregion
@@ -1,8 +1,12 @@
 from .db_archive import (get_next_archive_date, 
-                         get_archived_name,
-                         update_next_archive_date)
+                         archived_name,
+                         set_next_archive_at)
 from .db_servers import (log_server, 
+                         log_servers,
+                         load_servers,
                          remove_discord_server, 
+                         get_server_settings,
+                         invalidate_server_settings,
                          get_rshuffle, 
                          get_ushuffle,
                          get_archive_category,
@@ -11,15 +15,54 @@ from .db_servers import (log_server,
                          set_wse_status,
                          get_active_wse_servers,
                          get_timeout_role)
+from .db_backfill import (get_backfill_cursor,
+                          save_backfill_cursor,
+                          write_backfill_batch)
+from .db_elections import (save_election,
+                           get_running_elections,
+                           finish_election)
+from .db_exports import (get_export_cursor,
+                         save_export_cursor,
+                         get_unfinished_exports,
+                         get_finished_exports)
+from .db_indexes import (ensure_indexes,
+                         report_indexes,
+                         check_query_plans)
+from .db_rollups import (bucket_start,
+                         get_user_window_stat,
+                         get_window_stats)
+from .db_stat_buffer import (buffer_user_stat,
+                             flush_user_stats,
+                             write_user_stat_increments,
+                             FLUSH_INTERVAL,
+                             LIVE_SINCE)
 from .db_user_stats import (inc_user_stat, 
                             update_user_stats, 
+                            update_voice_stats,
                             get_user_stat, 
                             get_user_stats, 
                             create_user,
-                            remove_user)
+                            remove_user,
+                            get_leaderboard,
+                            get_user_rank,
+                            backfill_user_scores)
 from .db_wse import (get_current_wse_price,
+                     get_current_wse_quote,
+                     warm_wse_price,
                      set_current_wse_price,
+                     set_current_wse_prices,
                      get_prices,
                      set_transaction,
                      get_last_transaction,
-                     get_transactions)
\ No newline at end of file
+                     get_wse_position,
+                     seed_wse_positions,
+                     get_transactions,
+                     get_wse_leaderboard)
+from .db_wse_candles import (get_price_history,
+                             rebuild_wse_candles,
+                             MAX_PRICE_POINTS)
+from .db_wse_retention import (migrate_wse_price_log,
+                               apply_wse_price_retention,
+                               compact_closed_wse_transactions,
+                               WSE_PRICE_RETENTION_DAYS,
+                               CLOSED_EXCHANGE_RETENTION_DAYS)
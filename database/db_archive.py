@@ -1,40 +1,40 @@
-from datetime import datetime, timedelta
+import discord
+from datetime import datetime
 from .db_globals import *
+from .db_servers import invalidate_server_settings
 from pytz import timezone
 
+_next_archive_date: datetime | None = None
+""" In-memory copy of the legacy global archive date """
 
-def get_next_archive_date() -> datetime:
+
+async def get_next_archive_date() -> datetime:
+    """ Returns the legacy global archive date, which guilds without their own
+        schedule yet start from """
+    global _next_archive_date
+    if _next_archive_date is not None:
+        return _next_archive_date
     collection = db.next_archive_date
-    data = collection.find_one({"_id": DATE_ID}, {"_id": 0})
+    data = await collection.find_one({"_id": DATE_ID}, {"_id": 0})
     if data is None:
         raise Exception("Couldn't find document")
     eastern = timezone("US/Eastern")
-    next_archive_date = eastern.localize(
+    _next_archive_date = eastern.localize(
         datetime(data["year"], data["month"], data["day"],
                  data["hour"], data["minute"], data["second"])
     )
-    return next_archive_date
+    return _next_archive_date
 
 
-def get_archived_name(channel_name: str) -> str:
-    date = get_next_archive_date()
-    month = str(date.month)
-    day = str(date.day)
+def archived_name(channel_name: str, date: datetime) -> str:
+    """ Returns the name a channel is given when it's archived on the given date """
     year = str(date.year)
-    return f"{channel_name}-{month}-{day}-{year[len(year) - 2:]}"
+    return f"{channel_name}-{date.month}-{date.day}-{year[len(year) - 2:]}"
 
 
-def update_next_archive_date(archive_freq: timedelta) -> None:
-    old_date = get_next_archive_date()
-    new_date: datetime = old_date + archive_freq
-    new_date_fields = {
-        "year": new_date.year,
-        "month": new_date.month,
-        "day": new_date.day,
-        "hour": new_date.hour,
-        "minute": new_date.minute,
-        "second": new_date.second
-    }
-    collection = db.next_archive_date
-    collection.update_one(
-        {"_id": DATE_ID}, {"$set": new_date_fields}, upsert=True)
+async def set_next_archive_at(guild: discord.Guild, next_archive_at: datetime) -> None:
+    """ Saves when the guild's general chat is next archived """
+    connected_servers = db.connected_servers
+    await connected_servers.update_one({"_id": guild.id},
+                                       {"$set": {"next_archive_at": next_archive_at}})
+    invalidate_server_settings(guild)
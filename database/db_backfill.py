@@ -0,0 +1,50 @@
+import discord
+from .db_globals import *
+from .db_stat_buffer import write_user_stat_increments
+from datetime import datetime
+from pymongo.asynchronous.client_session import AsyncClientSession
+
+
+async def get_backfill_cursor(channel: discord.abc.GuildChannel, run: str) -> dict | None:
+    """ Returns where the given backfill run got to in the channel, if it's been started """
+    backfill_cursors = db.backfill_cursors
+    return await backfill_cursors.find_one({"_id": {"channel_id": channel.id, "run": run}})
+
+
+async def save_backfill_cursor(channel: discord.abc.GuildChannel, run: str,
+                               last_message_id: int | None, messages: int, done: bool,
+                               session: AsyncClientSession | None = None) -> None:
+    """ Records the last message the backfill run counted in the channel """
+    backfill_cursors = db.backfill_cursors
+    await backfill_cursors.update_one({
+        "_id": {
+            "channel_id": channel.id,
+            "run": run
+        }
+    },
+        {
+        "$set": {
+            "server_id": channel.guild.id,
+            "channel_name": channel.name,
+            "last_message_id": last_message_id,
+            "done": done,
+            "last_updated": datetime.now()
+        },
+        "$inc": {"messages": messages}
+    },
+        upsert=True, session=session)
+
+
+async def write_backfill_batch(channel: discord.abc.GuildChannel, run: str,
+                               pending: dict[tuple[int, int, str, datetime], int],
+                               names: dict[tuple[int, int], tuple[str, str, bool]],
+                               last_message_id: int | None, messages: int, done: bool) -> None:
+    """ Adds a batch of backfilled stat increments and advances the run's cursor in the
+        channel in one transaction, so a batch is either counted with its cursor or not
+        at all and resuming never counts it twice """
+    async def write(session: AsyncClientSession) -> None:
+        await write_user_stat_increments(pending, names, session)
+        await save_backfill_cursor(channel, run, last_message_id, messages, done, session)
+
+    async with db.client.start_session() as session:
+        await session.with_transaction(write)
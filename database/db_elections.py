@@ -0,0 +1,21 @@
+from .db_globals import *
+from datetime import datetime
+
+
+async def save_election(election: dict) -> None:
+    """ Persists an election's state (pools and next draw time), keyed by guild ID """
+    elections = db.elections
+    await elections.replace_one({"_id": election["_id"]},
+                                {**election, "last_updated": datetime.now()}, upsert=True)
+
+
+async def get_running_elections() -> list[dict]:
+    """ Returns the state of every election that hasn't finished """
+    elections = db.elections
+    return await elections.find({"done": False}).to_list()
+
+
+async def finish_election(guild_id: int) -> None:
+    elections = db.elections
+    await elections.update_one({"_id": guild_id},
+                               {"$set": {"done": True, "last_updated": datetime.now()}})
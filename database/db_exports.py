@@ -0,0 +1,34 @@
+import discord
+from .db_globals import *
+from datetime import datetime
+
+
+async def get_export_cursor(channel: discord.abc.GuildChannel) -> dict | None:
+    """ Returns how far the channel's archive export got, if it's been started """
+    archive_exports = db.archive_exports
+    return await archive_exports.find_one({"_id": channel.id})
+
+
+async def save_export_cursor(channel: discord.abc.GuildChannel, export: dict) -> None:
+    """ Records the export's progress (file, size, last message written, manifest once done) """
+    archive_exports = db.archive_exports
+    await archive_exports.update_one({"_id": channel.id},
+                                     {"$set": {
+                                         **export,
+                                         "server_id": channel.guild.id,
+                                         "channel_name": channel.name,
+                                         "last_updated": datetime.now()
+                                     }},
+                                     upsert=True)
+
+
+async def get_unfinished_exports() -> list[dict]:
+    """ Returns the cursors of every export that was interrupted before it finished """
+    archive_exports = db.archive_exports
+    return await archive_exports.find({"done": False}).to_list()
+
+
+async def get_finished_exports(channel_ids: list[int]) -> set[int]:
+    """ Returns the IDs of the given channels whose export has finished """
+    archive_exports = db.archive_exports
+    return set(await archive_exports.distinct("_id", {"_id": {"$in": channel_ids}, "done": True}))
@@ -0,0 +1,116 @@
+from .db_globals import *
+from .db_user_stats import LEADERBOARD_SORT
+from .db_wse_retention import ensure_wse_prices_collection
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "user_stats": [
+        # leaderboard pages, rank counts and get_user_stats
+        IndexModel([("_id.server_id", ASCENDING), ("bot", ASCENDING)] + LEADERBOARD_SORT),
+    ],
+    "user_stats_rollup": [
+        # windowed stats only read the buckets in range
+        IndexModel([("_id.server_id", ASCENDING), ("_id.granularity", ASCENDING),
+                    ("_id.bucket", ASCENDING), ("_id.user_id", ASCENDING)]),
+    ],
+    "wse_prices": [
+        # latest price and price history are read newest/oldest first per guild
+        IndexModel([("server_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "wse_price_candles": [
+        # a guild's candles at one resolution, newest first
+        IndexModel([("_id.server_id", ASCENDING), ("_id.resolution", ASCENDING),
+                    ("_id.bucket", DESCENDING)]),
+    ],
+    "wse_positions": [
+        # every position in a guild, for the leaderboard
+        IndexModel([("_id.server_id", ASCENDING)]),
+    ],
+    "wse_transaction_log": [
+        # a member's transactions, most recent first
+        IndexModel([("server_id", ASCENDING), ("user_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "connected_servers": [
+        # servers with an open WSE, loaded at startup
+        IndexModel([("wse", ASCENDING)]),
+    ],
+}
+""" Every index the bot's queries rely on, by collection """
+
+HOT_QUERIES: list[tuple[str, dict, list | None]] = [
+    ("user_stats", {"_id.server_id": 0, "bot": False}, LEADERBOARD_SORT),
+    ("user_stats_rollup", {"_id.server_id": 0, "_id.granularity": "hour",
+                           "_id.bucket": {"$gte": datetime.min}}, None),
+    ("wse_prices", {"server_id": 0}, [("timestamp", DESCENDING)]),
+    ("wse_price_candles", {"_id.server_id": 0, "_id.resolution": "day"}, [("_id.bucket", DESCENDING)]),
+    ("wse_positions", {"_id.server_id": 0}, None),
+    ("wse_transaction_log", {"server_id": 0, "user_id": 0}, [("timestamp", DESCENDING)]),
+    ("connected_servers", {"wse": True}, None),
+]
+""" Representative (collection, filter, sort) of each query that runs on a hot path """
+
+
+async def ensure_indexes() -> list[str]:
+    """ Creates any registered index that doesn't exist yet (existing ones are left
+        alone), returns the names of every registered index """
+    await ensure_wse_prices_collection()
+    names = []
+    for collection_name, indexes in INDEXES.items():
+        names += await db[collection_name].create_indexes(indexes)
+    return names
+
+
+async def report_indexes() -> dict[str, dict[str, list[str]]]:
+    """ Compares each collection's indexes to the registry, returns the registered
+        indexes that are missing, plus existing indexes that haven't been used since
+        the server last restarted or that aren't registered at all """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        registered = {index.document["name"] for index in indexes}
+        cursor = await db[collection_name].aggregate([{"$indexStats": {}}])
+        usage = {stat["name"]: stat["accesses"]["ops"] async for stat in cursor}
+        usage.pop("_id_", None)
+        report[collection_name] = {
+            "missing": sorted(registered - set(usage)),
+            "unused": sorted(name for name, ops in usage.items() if ops == 0),
+            "unregistered": sorted(set(usage) - registered)
+        }
+    return report
+
+
+async def check_query_plans() -> None:
+    """ Explains every hot query and raises if any of them falls back to a
+        collection scan """
+    collscans = []
+    for collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        plan = await cursor.explain()
+        # time-series explains nest the planner inside their stages, so look for
+        # every winning plan rather than a fixed path
+        if any(_has_stage(winning_plan, "COLLSCAN") for winning_plan in _find_key(plan, "winningPlan")):
+            collscans.append(f"{collection_name}: {query}")
+    if collscans:
+        raise Exception("Hot queries doing a COLLSCAN: " + "; ".join(collscans))
+
+
+def _find_key(plan, key: str) -> list:
+    """ Recursively collects the values of the given key anywhere in an explain plan """
+    if isinstance(plan, dict):
+        found = [plan[key]] if key in plan else []
+        return found + [value for item in plan.values() for value in _find_key(item, key)]
+    if isinstance(plan, list):
+        return [value for item in plan for value in _find_key(item, key)]
+    return []
+
+
+def _has_stage(plan, stage: str) -> bool:
+    """ Recursively looks for the given stage anywhere in an explain plan """
+    if isinstance(plan, dict):
+        return plan.get("stage") == stage or any(_has_stage(value, stage)
+                                                 for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_stage(item, stage) for item in plan)
+    return False
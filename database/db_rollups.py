@@ -0,0 +1,121 @@
+import discord
+from .db_globals import *
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from typing import Literal
+
+Granularity = Literal["hour", "day"]
+
+STATS = ["mentioned", "sent_messages", "time_in_vc"]
+
+
+def to_utc(dt: datetime) -> datetime:
+    """ Converts a datetime to naive UTC (naive input is treated as local time) """
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(dt: datetime, granularity: Granularity) -> datetime:
+    """ Returns the start of the UTC hour or day bucket the given datetime falls in """
+    return _truncate(to_utc(dt), granularity)
+
+
+def _truncate(utc_dt: datetime, granularity: Granularity) -> datetime:
+    hour = utc_dt.replace(minute=0, second=0, microsecond=0)
+    return hour if granularity == "hour" else hour.replace(hour=0)
+
+
+def split_by_hour(start: datetime, end: datetime) -> dict[datetime, int]:
+    """ Splits the seconds between start and end across the UTC hour buckets they cover """
+    start, end = to_utc(start), to_utc(end)
+    result: dict[datetime, int] = {}
+    while start < end:
+        hour = _truncate(start, "hour")
+        boundary = min(hour + timedelta(hours=1), end)
+        result[hour] = result.get(hour, 0) + int((boundary - start).total_seconds())
+        start = boundary
+    return result
+
+
+def rollup_requests(hourly: dict[tuple[int, int, datetime], dict[str, int]],
+                    names: dict[tuple[int, int], tuple[str, str, bool]]) -> list[UpdateOne]:
+    """ Builds the upserts that add the given per-hour increments, keyed by
+        (server_id, user_id, hour), to both the hourly and daily rollups """
+    buckets: dict[tuple[int, int, Granularity, datetime], dict[str, int]] = {}
+    for (server_id, user_id, hour), incs in hourly.items():
+        for granularity in ("hour", "day"):
+            key = (server_id, user_id, granularity,
+                   _truncate(hour, granularity))
+            bucket_incs = buckets.setdefault(key, {})
+            for field, inc in incs.items():
+                bucket_incs[field] = bucket_incs.get(field, 0) + inc
+
+    requests = []
+    for (server_id, user_id, granularity, bucket), incs in buckets.items():
+        server_name, user_name, bot = names[(server_id, user_id)]
+        requests.append(UpdateOne({
+            "_id": {
+                "server_id": server_id,
+                "user_id": user_id,
+                "granularity": granularity,
+                "bucket": bucket
+            }
+        },
+            {
+            "$set": {
+                "server_name": server_name,
+                "user_name": user_name,
+                "bot": bot
+            },
+            "$inc": incs
+        },
+            upsert=True))
+    return requests
+
+
+def _granularity_for(start: datetime, end: datetime) -> Granularity:
+    """ Use hourly buckets for short windows and daily ones for everything else """
+    return "hour" if end - start <= timedelta(days=2) else "day"
+
+
+def _window_match(discord_server: discord.Guild, start: datetime, end: datetime) -> dict:
+    start, end = to_utc(start), to_utc(end)
+    granularity = _granularity_for(start, end)
+    return {
+        "_id.server_id": discord_server.id,
+        "_id.granularity": granularity,
+        "_id.bucket": {"$gte": _truncate(start, granularity),
+                       "$lt": end}
+    }
+
+
+async def get_user_window_stat(discord_server: discord.Guild, user_id: int,
+                               start: datetime, end: datetime) -> dict[str, int]:
+    """ Returns the given user's stats between start and end, read from the rollup
+        buckets covering that window """
+    user_stats_rollup = db.user_stats_rollup
+    match = _window_match(discord_server, start, end)
+    match["_id.user_id"] = user_id
+    totals = {stat: 0 for stat in STATS}
+    async for bucket in user_stats_rollup.find(match, {stat: 1 for stat in STATS}):
+        for stat in STATS:
+            totals[stat] += bucket.get(stat, 0)
+    return totals
+
+
+async def get_window_stats(discord_server: discord.Guild, start: datetime, end: datetime):
+    """ Returns every non-bot user's stats between start and end, read from the rollup
+        buckets covering that window """
+    user_stats_rollup = db.user_stats_rollup
+    match = _window_match(discord_server, start, end)
+    match["bot"] = False
+    group: dict = {"_id": "$_id.user_id", "user_name": {"$last": "$user_name"}}
+    for stat in STATS:
+        group[stat] = {"$sum": f"${stat}"}
+    cursor = await user_stats_rollup.aggregate([
+        {"$match": match},
+        {"$sort": {"_id.bucket": 1}},
+        {"$group": group},
+        {"$project": {"_id": 0}}
+    ])
+    return await cursor.to_list()
+
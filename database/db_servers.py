@@ -1,16 +1,137 @@
 import discord
 from datetime import datetime
 from .db_globals import *
+from cachetools import TTLCache
+from pymongo import UpdateOne
 from typing import cast
 
-
-def log_server(discord_server: discord.Guild) -> bool:
+SETTINGS_TTL = 300
+""" Seconds a guild's cached settings are trusted before being re-read """
+SETTINGS_PROJECTION = {
+    "archive_category": 1,
+    "chat_to_archive": 1,
+    "timeout_role": 1,
+    "wse": 1,
+    "wse_user_id": 1,
+    "rshuffle": 1,
+    "ushuffle": 1,
+    "archive_int": 1,
+    "timezone": 1,
+    "next_archive_at": 1
+}
+""" Fields of a connected_servers document that make up a guild's settings """
+
+_settings_cache: TTLCache = TTLCache(maxsize=1024, ttl=SETTINGS_TTL)
+""" Guild settings by guild ID """
+_shuffle_fingerprints: dict[tuple[int, str], int] = {}
+""" Hash of the rshuffle/ushuffle list last seen in the DB, by (guild ID, field) """
+
+
+async def log_server(discord_server: discord.Guild) -> bool:
+    """ Upserts the guild's Discord info in one round trip, returns True if this
+        created its document """
+    connected_servers = db.connected_servers
+    try:
+        result = await connected_servers.bulk_write([_log_server_request(discord_server)])
+    except Exception:
+        _forget_shuffles(discord_server.id)
+        raise
+    _refresh_cached_shuffles(discord_server)
+    return result.upserted_count == 1
+
+
+async def log_servers(guilds: list[discord.Guild]) -> int:
+    """ Upserts the Discord info of every given guild in one bulk write, returns the
+        number of documents created """
+    if not guilds:
+        return 0
+    connected_servers = db.connected_servers
+    try:
+        result = await connected_servers.bulk_write(
+            [_log_server_request(guild) for guild in guilds], ordered=False)
+    except Exception:
+        for guild in guilds:
+            _forget_shuffles(guild.id)
+        raise
+    for guild in guilds:
+        _refresh_cached_shuffles(guild)
+    return result.upserted_count
+
+
+def _log_server_request(discord_server: discord.Guild) -> UpdateOne:
+    """ Builds the upsert for the guild's Discord info. The role and member name lists
+        are only rewritten when they differ from what was last read or written, but are
+        still set if the document has to be created again """
+    server_data = _server_data(discord_server)
+    del server_data["_id"]
+    on_insert: dict = {"joined": datetime.now()}
+    for field in ("rshuffle", "ushuffle"):
+        fingerprint = hash(tuple(server_data[field]))
+        if _shuffle_fingerprints.get((discord_server.id, field)) == fingerprint:
+            on_insert[field] = server_data.pop(field)
+        else:
+            _shuffle_fingerprints[(discord_server.id, field)] = fingerprint
+    return UpdateOne({"_id": discord_server.id},
+                     {"$set": server_data,
+                      "$setOnInsert": on_insert},
+                     upsert=True)
+
+
+def _refresh_cached_shuffles(discord_server: discord.Guild) -> None:
+    """ Updates the role and member name lists of the guild's cached settings, the only
+        settings fields log_server writes, so the rest of the cache stays primed """
+    cached = _settings_cache.get(discord_server.id)
+    if cached is None:
+        return
+    cached["rshuffle"] = list(map(_role_name, discord_server.roles))
+    cached["ushuffle"] = list(map(_member_name, discord_server.members))
+
+
+def _remember_shuffles(guild_id: int, settings: dict) -> None:
+    """ Records the shuffle lists the DB is known to hold, so log_server can skip
+        rewriting them when they haven't changed """
+    for field in ("rshuffle", "ushuffle"):
+        if settings.get(field) is not None:
+            _shuffle_fingerprints[(guild_id, field)] = hash(tuple(settings[field]))
+
+
+def _forget_shuffles(guild_id: int) -> None:
+    for field in ("rshuffle", "ushuffle"):
+        _shuffle_fingerprints.pop((guild_id, field), None)
+
+
+async def load_servers(guilds: list[discord.Guild]) -> dict[int, dict]:
+    """ Fetches the settings of every given guild with one query, seeding documents for
+        guilds that don't have one in one bulk write. Primes the settings cache and
+        returns the settings by guild ID """
     connected_servers = db.connected_servers
-    server_exists = bool(connected_servers.find_one(
-        {"_id": discord_server.id}))
+    query = connected_servers.find({"_id": {"$in": [guild.id for guild in guilds]}},
+                                   SETTINGS_PROJECTION)
+    settings = {doc["_id"]: doc async for doc in query}
+
+    seeds = []
+    for guild in guilds:
+        if guild.id in settings:
+            continue
+        server_data = _server_data(guild)
+        server_data["joined"] = datetime.now()
+        seeds.append(UpdateOne({"_id": guild.id}, {"$set": server_data}, upsert=True))
+        settings[guild.id] = {field: server_data[field]
+                              for field in SETTINGS_PROJECTION if field in server_data}
+    if seeds:
+        await connected_servers.bulk_write(seeds, ordered=False)
+
+    for guild_id, guild_settings in settings.items():
+        _settings_cache[guild_id] = guild_settings
+        _remember_shuffles(guild_id, guild_settings)
+    return settings
+
+
+def _server_data(discord_server: discord.Guild) -> dict:
+    """ Builds the connected_servers fields that mirror the guild's Discord info """
     icon_url = "" if discord_server.icon is None else discord_server.icon.url
     description_exists = bool(discord_server.description)
-    server_data = {
+    return {
         "_id": discord_server.id,
         "name": str(discord_server.name),
         "description": str(discord_server.description) if description_exists else "",
@@ -20,9 +141,6 @@ def log_server(discord_server: discord.Guild) -> bool:
         "rshuffle": list(map(_role_name, discord_server.roles)),
         "ushuffle": list(map(_member_name, discord_server.members))
     }
-    if not server_exists:
-        server_data["joined"] = datetime.now()
-    return log(discord_server, connected_servers, server_data)
 
 
 def _role_name(role: discord.Role) -> str:
@@ -33,86 +151,83 @@ def _member_name(member: discord.Member) -> str:
     return member.name
 
 
-def remove_discord_server(guild: discord.Guild) -> int:
+async def remove_discord_server(guild: discord.Guild) -> int:
     """ Remove the given server from all relevant collections, returns the number of documents deleted """
     connected_servers = db.connected_servers
     user_stats = db.user_stats
-    total = connected_servers.delete_many({"_id": guild.id}).deleted_count
+    total = (await connected_servers.delete_many({"_id": guild.id})).deleted_count
+    invalidate_server_settings(guild)
+    _forget_shuffles(guild.id)
     return total
 
 
-def get_rshuffle(guild: discord.Guild) -> list[str]:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({
-        "_id": guild.id
-    },
-        {
-        "rshuffle": 1
-    })
-    if query is None:
-        return []
-    query_dict: dict = cast(dict, query)
-    return [] if query_dict.get("rshuffle") == None else query_dict["rshuffle"]
+async def get_server_settings(guild: discord.Guild) -> dict:
+    """ Returns the guild's settings from connected_servers, served from a TTL cache
+        so config reads don't pay a DB round trip each time """
+    settings = _settings_cache.get(guild.id)
+    if settings is None:
+        connected_servers = db.connected_servers
+        query = await connected_servers.find_one({"_id": guild.id},
+                                                 SETTINGS_PROJECTION)
+        settings = {} if query is None else cast(dict, query)
+        _settings_cache[guild.id] = settings
+        _remember_shuffles(guild.id, settings)
+    return settings
 
 
-def get_ushuffle(guild: discord.Guild) -> list[str]:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({"_id": guild.id},
-                                       {"ushuffle": 1})
-    if query is None:
-        return []
-    query_dict: dict = cast(dict, query)
-    return [] if query_dict.get("ushuffle") == None else query_dict["ushuffle"]
+def invalidate_server_settings(guild: discord.Guild) -> None:
+    """ Drops the guild's cached settings so the next read goes to the DB """
+    _settings_cache.pop(guild.id, None)
 
 
-def get_archive_category(guild: discord.Guild) -> str:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({"_id": guild.id},
-                                       {"archive_category": 1})
-    query_dict: dict = cast(dict, query)
-    return str(query_dict["archive_category"])
+async def get_rshuffle(guild: discord.Guild) -> list[str]:
+    settings = await get_server_settings(guild)
+    return [] if settings.get("rshuffle") == None else settings["rshuffle"]
 
 
-def get_chat_to_archive(guild: discord.Guild) -> str:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({"_id": guild.id},
-                                       {"chat_to_archive": 1})
-    query_dict: dict = cast(dict, query)
-    return str(query_dict["chat_to_archive"])
+async def get_ushuffle(guild: discord.Guild) -> list[str]:
+    settings = await get_server_settings(guild)
+    return [] if settings.get("ushuffle") == None else settings["ushuffle"]
 
 
-def get_wse_status(guild: discord.Guild) -> bool:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({"_id": guild.id},
-                                       {"wse": 1})
-    query_dict = cast(dict, query)
-    status = bool(query_dict["wse"])
+async def get_archive_category(guild: discord.Guild) -> str:
+    settings = await get_server_settings(guild)
+    return str(settings["archive_category"])
+
+
+async def get_chat_to_archive(guild: discord.Guild) -> str:
+    settings = await get_server_settings(guild)
+    return str(settings["chat_to_archive"])
+
+
+async def get_wse_status(guild: discord.Guild) -> bool:
+    settings = await get_server_settings(guild)
+    status = bool(settings["wse"])
     return status
 
 
-def set_wse_status(guild: discord.Guild, status: bool, user_id: int | None = None):
+async def set_wse_status(guild: discord.Guild, status: bool, user_id: int | None = None):
     if status and user_id is None:
         raise Exception(
             "Must provide the ID of the user to crash the WSE if enabling the WSE.")
 
     connected_servers = db.connected_servers
-    query = connected_servers.update_one({"_id": guild.id},
+    query = await connected_servers.update_one({"_id": guild.id},
                                          {"$set": {
                                              "wse": status,
-                                             "wse_user_id": -1 if user_id is None else user_id
+                                             "wse_user_id": -1 if user_id is None else user_id,
+                                             "wse_closed_at": None if status else datetime.now()
                                          }
     })
+    invalidate_server_settings(guild)
 
 
-def get_active_wse_servers():
+async def get_active_wse_servers():
     connected_servers = db.connected_servers
     query = connected_servers.find({"wse": True})
-    return [server for server in query]
+    return [server async for server in query]
 
 
-def get_timeout_role(guild: discord.Guild) -> str:
-    connected_servers = db.connected_servers
-    query = connected_servers.find_one({"_id": guild.id},
-                                       {"timeout_role": 1})
-    query_dict: dict = cast(dict, query)
-    return str(query_dict["timeout_role"])
\ No newline at end of file
+async def get_timeout_role(guild: discord.Guild) -> str:
+    settings = await get_server_settings(guild)
+    return str(settings["timeout_role"])
\ No newline at end of file
@@ -0,0 +1,166 @@
+import asyncio
+import discord
+from .db_globals import *
+from .db_rollups import STATS, bucket_start, rollup_requests
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.asynchronous.client_session import AsyncClientSession
+
+FLUSH_INTERVAL = 10
+""" Seconds between timed flushes of the stat buffer """
+FLUSH_THRESHOLD = 500
+""" Number of buffered counters that triggers an early flush """
+LIVE_SINCE = datetime.now()
+""" When this process started counting stats live. Backfills stop here so they never
+    recount messages the live counters already have """
+
+_pending: dict[tuple[int, int, str, datetime], int] = {}
+""" Unflushed increments keyed by (server_id, user_id, field, UTC hour) """
+_names: dict[tuple[int, int], tuple[str, str, bool]] = {}
+""" Latest (server_name, user_name, bot) seen for each (server_id, user_id) """
+_in_flight: dict[tuple[int, int, str, datetime], int] = {}
+""" Increments taken out of _pending by the flush that's writing them, until the
+    write lands (reads still count them in the meantime) """
+_pending_rollups: dict[tuple[int, int, datetime], dict[str, int]] = {}
+""" Rollup increments keyed by (server_id, user_id, UTC hour) whose write failed after
+    the lifetime totals were already written """
+_rollup_names: dict[tuple[int, int], tuple[str, str, bool]] = {}
+""" Names for the users in _pending_rollups """
+_flush_lock = asyncio.Lock()
+""" Keeps timed, threshold and shutdown flushes from overlapping """
+
+
+def buffer_user_stat(discord_server: discord.Guild, user, field: str, inc=1,
+                     at: datetime | None = None) -> bool:
+    """ Buffers an increment of a user stat in memory, returns True once the
+        buffer is big enough that it should be flushed """
+    hour = bucket_start(datetime.now() if at is None else at, "hour")
+    key = (discord_server.id, user.id, field, hour)
+    _pending[key] = _pending.get(key, 0) + inc
+    _names[(discord_server.id, user.id)] = (
+        discord_server.name, user.name, bool(user.bot))
+    return len(_pending) >= FLUSH_THRESHOLD
+
+
+def pending_user_stats(server_id: int, user_id: int) -> dict[str, int]:
+    """ Returns the increments for the given user that haven't been flushed yet """
+    result: dict[str, int] = {}
+    for buffer in (_pending, _in_flight):
+        for (pending_server_id, pending_user_id, field, _), inc in buffer.items():
+            if pending_server_id == server_id and pending_user_id == user_id:
+                result[field] = result.get(field, 0) + inc
+    return result
+
+
+async def flush_user_stats() -> int:
+    """ Writes all buffered increments to the lifetime totals and the activity
+        rollups with one bulk write each, returns the number of user documents touched """
+    async with _flush_lock:
+        pending = dict(_pending)
+        names = dict(_names)
+        _in_flight.update(pending)
+        _pending.clear()
+        _names.clear()
+
+        stats_data, hourly = _group_increments(pending)
+        try:
+            touched = await _write_totals(stats_data, names)
+        except Exception:
+            # put the increments back so they go out with the next flush
+            for key, inc in pending.items():
+                _pending[key] = _pending.get(key, 0) + inc
+            for key, name in names.items():
+                _names.setdefault(key, name)
+            raise
+        finally:
+            _in_flight.clear()
+        await write_rollups(hourly, names)
+        return touched
+
+
+async def write_user_stat_increments(pending: dict[tuple[int, int, str, datetime], int],
+                                     names: dict[tuple[int, int], tuple[str, str, bool]],
+                                     session: AsyncClientSession | None = None) -> int:
+    """ Adds increments keyed by (server_id, user_id, field, UTC hour) to the lifetime
+        totals and the activity rollups with one bulk write each, returns the number
+        of user documents touched. Nothing is buffered on failure, so the writes can
+        be part of the caller's transaction """
+    stats_data, hourly = _group_increments(pending)
+    touched = await _write_totals(stats_data, names, session)
+    if hourly:
+        await db.user_stats_rollup.bulk_write(
+            rollup_requests(hourly, names), ordered=False, session=session)
+    return touched
+
+
+async def write_rollups(hourly: dict[tuple[int, int, datetime], dict[str, int]],
+                        names: dict[tuple[int, int], tuple[str, str, bool]]) -> None:
+    """ Adds per-hour increments keyed by (server_id, user_id, UTC hour) to the activity
+        rollups, along with any left over from an earlier failed write. The lifetime
+        totals are written first, so on failure only the rollup increments are kept
+        for the next flush before the error is raised """
+    merged = {key: dict(incs) for key, incs in _pending_rollups.items()}
+    merged_names = {**_rollup_names, **names}
+    _pending_rollups.clear()
+    _rollup_names.clear()
+    for key, incs in hourly.items():
+        hour_incs = merged.setdefault(key, {})
+        for field, inc in incs.items():
+            hour_incs[field] = hour_incs.get(field, 0) + inc
+    if not merged:
+        return
+
+    try:
+        await db.user_stats_rollup.bulk_write(
+            rollup_requests(merged, merged_names), ordered=False)
+    except Exception:
+        for key, incs in merged.items():
+            hour_incs = _pending_rollups.setdefault(key, {})
+            for field, inc in incs.items():
+                hour_incs[field] = hour_incs.get(field, 0) + inc
+        for (server_id, user_id, _) in merged:
+            _rollup_names.setdefault(
+                (server_id, user_id), merged_names[(server_id, user_id)])
+        raise
+
+
+def _group_increments(pending: dict[tuple[int, int, str, datetime], int]):
+    """ Groups buffered increments into per-user lifetime totals and per-hour rollup increments """
+    stats_data: dict[tuple[int, int], dict[str, int]] = {}
+    hourly: dict[tuple[int, int, datetime], dict[str, int]] = {}
+    for (server_id, user_id, field, hour), inc in pending.items():
+        user_incs = stats_data.setdefault(
+            (server_id, user_id), {stat: 0 for stat in STATS})
+        user_incs[field] += inc
+        user_incs["score"] = user_incs.get("score", 0) + inc
+        hour_incs = hourly.setdefault((server_id, user_id, hour), {})
+        hour_incs[field] = hour_incs.get(field, 0) + inc
+    return stats_data, hourly
+
+
+async def _write_totals(stats_data: dict[tuple[int, int], dict[str, int]],
+                        names: dict[tuple[int, int], tuple[str, str, bool]],
+                        session: AsyncClientSession | None = None) -> int:
+    if not stats_data:
+        return 0
+
+    requests = []
+    for (server_id, user_id), incs in stats_data.items():
+        server_name, user_name, _ = names[(server_id, user_id)]
+        requests.append(UpdateOne({
+            "_id": {
+                "server_id": server_id,
+                "user_id": user_id
+            }
+        },
+            {
+            "$set": {
+                "server_name": server_name,
+                "user_name": user_name
+            },
+            "$inc": incs
+        },
+            upsert=True))
+
+    await db.user_stats.bulk_write(requests, ordered=False, session=session)
+    return len(requests)
@@ -1,9 +1,15 @@
 import discord
 from .db_globals import *
+from .db_rollups import split_by_hour
+from .db_stat_buffer import pending_user_stats, write_rollups
 from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
 
+LEADERBOARD_SORT = [("score", DESCENDING), ("_id.user_id", ASCENDING)]
+""" Leaderboard order, ties broken by user ID so pages are stable """
 
-def inc_user_stat(discord_server: discord.Guild, user, field: str, inc=1) -> bool:
+
+async def inc_user_stat(discord_server: discord.Guild, user, field: str, inc=1) -> bool:
     user_stats = db.user_stats
     stats = ["mentioned", "sent_messages", "time_in_vc"]
     stats_data = {}
@@ -12,7 +18,8 @@ def inc_user_stat(discord_server: discord.Guild, user, field: str, inc=1) -> boo
             stats_data[stat] = inc
         else:
             stats_data[stat] = 0
-    return user_stats.update_one({
+    stats_data["score"] = inc
+    return (await user_stats.update_one({
         "_id": {
             "server_id": discord_server.id,
             "user_id": user.id
@@ -25,15 +32,15 @@ def inc_user_stat(discord_server: discord.Guild, user, field: str, inc=1) -> boo
         },
         "$inc": stats_data
     },
-        upsert=True).upserted_id != None
+        upsert=True)).upserted_id != None
 
 
-def update_user_stats(discord_server: discord.Guild, user, **kwargs) -> bool:
+async def update_user_stats(discord_server: discord.Guild, user, **kwargs) -> bool:
     user_stats = db.user_stats
     set_fields: dict = {
         "server_name": discord_server.name, "user_name": user.name}
     set_fields.update(**kwargs)
-    return user_stats.update_one({
+    return (await user_stats.update_one({
         "_id": {
             "server_id": discord_server.id,
             "user_id": user.id
@@ -42,23 +49,71 @@ def update_user_stats(discord_server: discord.Guild, user, **kwargs) -> bool:
         {
         "$set": set_fields
     },
-        upsert=True).upserted_id != None
+        upsert=True)).upserted_id != None
+
+
+async def update_voice_stats(discord_server: discord.Guild, now: datetime,
+                             timed_since: dict[discord.Member, datetime],
+                             connected: dict[discord.Member, bool]) -> None:
+    """ Adds the VC time members accrued between their timed_since and now, and applies
+        VC connection changes, with one bulk write (plus one for the activity rollups) """
+    user_stats = db.user_stats
+    time_in_vc: dict[discord.Member, int] = {}
+    hourly: dict[tuple[int, int, datetime], dict[str, int]] = {}
+    names: dict[tuple[int, int], tuple[str, str, bool]] = {}
+    for member, since in timed_since.items():
+        time_in_vc[member] = int((now - since).total_seconds())
+        for hour, seconds in split_by_hour(since, now).items():
+            hourly[(discord_server.id, member.id, hour)] = {"time_in_vc": seconds}
+        names[(discord_server.id, member.id)] = (
+            discord_server.name, member.name, member.bot)
 
+    requests = []
+    for member in set(time_in_vc) | set(connected):
+        update: dict = {"$set": {"server_name": discord_server.name,
+                                 "user_name": member.name}}
+        if member in time_in_vc:
+            update["$inc"] = {"time_in_vc": time_in_vc[member],
+                              "score": time_in_vc[member]}
+        if member in connected:
+            update["$set"]["connected_to_vc"] = connected[member]
+            if connected[member]:
+                update["$set"]["last_connected_to_vc"] = now
+        requests.append(UpdateOne({
+            "_id": {
+                "server_id": discord_server.id,
+                "user_id": member.id
+            }
+        }, update, upsert=True))
+    if requests:
+        await user_stats.bulk_write(requests, ordered=False)
+    await write_rollups(hourly, names)
 
-def get_user_stat(discord_server: discord.Guild, user_id: int, *fields):
+
+async def get_user_stat(discord_server: discord.Guild, user_id: int, *fields):
     user_stats = db.user_stats
     projection: dict = {}
     for field in fields:
         projection[field] = 1
-    return user_stats.find_one({
+    result = await user_stats.find_one({
         "_id": {
             "server_id": discord_server.id,
             "user_id": user_id
         }
     }, projection)
 
+    # include increments that are still sitting in the write-behind buffer
+    pending = pending_user_stats(discord_server.id, user_id)
+    for field, inc in pending.items():
+        if fields and field not in fields:
+            continue
+        if result is None:
+            result = {}
+        result[field] = result.get(field, 0) + inc
+    return result
+
 
-def get_user_stats(discord_server: discord.Guild):
+async def get_user_stats(discord_server: discord.Guild):
     user_stats = db.user_stats
     projection = {
         "_id": 0,
@@ -71,16 +126,16 @@ def get_user_stats(discord_server: discord.Guild):
         "_id.server_id": discord_server.id,
         "bot": False
     }, projection)
-    return list(users)
+    return await users.to_list()
 
 
-def create_user(discord_server: discord.Guild, user) -> bool:
+async def create_user(discord_server: discord.Guild, user) -> bool:
     user_stats = db.user_stats
-    find = user_stats.find_one(
+    find = await user_stats.find_one(
         {"_id": {"server_id": discord_server.id, "user_id": user.id}})
     if find != None:
         return False
-    return user_stats.update_one({
+    return (await user_stats.update_one({
         "_id": {
             "server_id": discord_server.id,
             "user_id": user.id
@@ -94,22 +149,81 @@ def create_user(discord_server: discord.Guild, user) -> bool:
             "time_in_vc": 0,
             "user_name": user.name,
             "vc_timer": False,
+            "score": 0,
             "connected_to_vc": False,
             "last_connected_to_vc": datetime.min,
             "bot": user.bot
         }
-    }, upsert=True).upserted_id != None
+    }, upsert=True)).upserted_id != None
 
 
-def remove_user(discord_server: discord.Guild, user) -> bool:
+async def remove_user(discord_server: discord.Guild, user) -> bool:
     user_stats = db.user_stats
-    find = user_stats.find_one(
+    find = await user_stats.find_one(
         {"_id": {"server_id": discord_server.id, "user_id": user.id}})
     if find != None:
         return False
-    return user_stats.delete_one({
+    return (await user_stats.delete_one({
         "_id": {
             "server_id": discord_server.id,
             "user_id": user.id
         }
-    }).deleted_count == 1
\ No newline at end of file
+    })).deleted_count == 1
+
+
+async def get_leaderboard(discord_server: discord.Guild, page: int = 0, page_size: int = 10):
+    """ Returns one page of the guild's non-bot users, ranked by score """
+    user_stats = db.user_stats
+    projection = {
+        "_id": 0,
+        "user_name": 1,
+        "mentioned": 1,
+        "sent_messages": 1,
+        "time_in_vc": 1,
+        "score": 1
+    }
+    users = user_stats.find({
+        "_id.server_id": discord_server.id,
+        "bot": False
+    }, projection, sort=LEADERBOARD_SORT, skip=page * page_size, limit=page_size)
+    return await users.to_list()
+
+
+async def get_user_rank(discord_server: discord.Guild, user_id: int) -> int | None:
+    """ Returns the user's 1-based position on the guild's leaderboard, or None if
+        they aren't on it """
+    user_stats = db.user_stats
+    user = await user_stats.find_one({
+        "_id": {
+            "server_id": discord_server.id,
+            "user_id": user_id
+        },
+        "bot": False
+    }, {"score": 1})
+    if user is None:
+        return None
+    score = user.get("score", 0)
+    ahead = await user_stats.count_documents({
+        "_id.server_id": discord_server.id,
+        "bot": False,
+        "$or": [
+            {"score": {"$gt": score}},
+            {"score": score, "_id.user_id": {"$lt": user_id}}
+        ]
+    })
+    return ahead + 1
+
+
+async def backfill_user_scores() -> int:
+    """ Computes score for user documents written before it was maintained,
+        returns the number of documents updated """
+    user_stats = db.user_stats
+    result = await user_stats.update_many({"score": {"$exists": False}}, [
+        {"$set": {"score": {"$add": [
+            {"$ifNull": ["$sent_messages", 0]},
+            {"$ifNull": ["$time_in_vc", 0]},
+            {"$ifNull": ["$mentioned", 0]}
+        ]}}}
+    ])
+    return result.modified_count
+
@@ -1,85 +1,184 @@
 import discord
 from .db_globals import *
+from .db_wse_retention import PRICE_COLLECTION
+from .db_wse_candles import MAX_PRICE_POINTS, candle_requests, get_price_history
 from datetime import datetime
 from typing import cast, Literal
 from bson.timestamp import Timestamp
+from pymongo import InsertOne, ReturnDocument
+from pymongo.asynchronous.client_session import AsyncClientSession
 
 
-def get_current_wse_price(discord_server: discord.Guild) -> float:
-    price_log = db.wse_price_log
-    query = price_log.find_one({"_id.server_id": discord_server.id}, {"_id": 0, "price": 1},
-                               sort=[("_id.timestamp", -1)])
-    query_dict = cast(dict, query)
-    price = float(query_dict["price"])
-    return price
+_price_cache: dict[int, tuple[float, datetime]] = {}
+""" Latest (price, timestamp) of each guild's WSE by guild ID. The price log stays the
+    source of truth, this just saves reading it back after every write """
 
 
-def set_current_wse_price(discord_server: discord.Guild, new_price: float) -> bool:
-    price_log = db.wse_price_log
-    timestamp = datetime.now()
-    return price_log.insert_one({
-        "_id": {
-            "server_id": discord_server.id,
-            "timestamp": timestamp
-        },
-        "price": new_price,
-    }).acknowledged
+async def get_current_wse_price(discord_server: discord.Guild) -> float:
+    if discord_server.id not in _price_cache:
+        await warm_wse_price(discord_server)
+    return _price_cache[discord_server.id][0]
+
 
+async def get_current_wse_quote(discord_server: discord.Guild) -> tuple[float, datetime]:
+    """ Returns the guild's current price along with when it was set """
+    if discord_server.id not in _price_cache:
+        await warm_wse_price(discord_server)
+    return _price_cache[discord_server.id]
 
-def get_prices(discord_server: discord.Guild):
-    timestamps = []
-    prices = []
 
-    price_log = db.wse_price_log
-    results = price_log.find({"_id.server_id": discord_server.id}, {
-                             "_id.timestamp": 1, "price": 1}, sort=[("_id.timestamp", 1)])
+async def warm_wse_price(discord_server: discord.Guild) -> float:
+    """ Loads the guild's latest price from the price log into the price cache """
+    prices = db[PRICE_COLLECTION]
+    query = await prices.find_one({"server_id": discord_server.id}, {"timestamp": 1, "price": 1},
+                                  sort=[("timestamp", -1)])
+    query_dict = cast(dict, query)
+    price = float(query_dict["price"])
+    _price_cache[discord_server.id] = (price, query_dict["timestamp"])
+    return price
 
-    for result in results:
-        timestamps.append(str(result["_id"]["timestamp"].date()))
-        prices.append(result["price"])
 
+async def set_current_wse_price(discord_server: discord.Guild, new_price: float) -> bool:
+    return await set_current_wse_prices({discord_server: new_price})
+
+
+async def set_current_wse_prices(new_prices: dict[discord.Guild, float]) -> bool:
+    """ Logs a new price for each of the given guilds with one bulk write """
+    if not new_prices:
+        return True
+    prices = db[PRICE_COLLECTION]
+    timestamp = datetime.now()
+    acknowledged = (await prices.bulk_write([InsertOne({
+        "server_id": guild.id,
+        "timestamp": timestamp,
+        "price": new_price,
+    }) for guild, new_price in new_prices.items()], ordered=False)).acknowledged
+    await db.wse_price_candles.bulk_write(candle_requests(
+        {guild.id: new_price for guild, new_price in new_prices.items()}, timestamp), ordered=False)
+    for guild, new_price in new_prices.items():
+        _price_cache[guild.id] = (new_price, timestamp)
+    return acknowledged
+
+
+async def get_prices(discord_server: discord.Guild, max_points: int = MAX_PRICE_POINTS):
+    """ Returns (dates, closing prices) of the guild's price history, downsampled to
+        daily or weekly candles once there are more than max_points ticks """
+    _, history = await get_price_history(discord_server, max_points)
+    timestamps = [str(candle["bucket"].date()) for candle in history]
+    prices = [candle["close"] for candle in history]
     return (timestamps, prices)
 
 
-def set_transaction(member: discord.Member, curr_price: float, transaction_type: Literal["buy", "sell"]) -> bool:
+async def set_transaction(member: discord.Member, curr_price: float, transaction_type: Literal["buy", "sell"]) -> bool:
+    """ Moves the member's position (buying only when not holding, selling only when
+        holding) and logs the transaction in one transaction, so a position never changes
+        without its ledger entry. Returns False, without logging anything, if the
+        position was already in the requested state """
     transaction_log = db.wse_transaction_log
     timestamp = datetime.now()
     guild = member.guild
-    last_transaction = get_last_transaction(member)
-    stock_value = 1
-    cash_value = 0
-
-    if last_transaction["action"] is not None:
-        if transaction_type == "buy":
-            stock_value = curr_price
-            cash_value = last_transaction["cash_value"] - curr_price
-        elif transaction_type == "sell":
-            stock_value = 0
-            cash_value = last_transaction["cash_value"] + curr_price
-
-    return transaction_log.insert_one({
-        "server_id": guild.id,
+
+    async def move_and_log(session: AsyncClientSession) -> bool:
+        position = await _move_position(member, curr_price, transaction_type, timestamp, session)
+        if position is None:
+            return False
+        return (await transaction_log.insert_one({
+            "server_id": guild.id,
+            "server_name": guild.name,
+            "user_id": member.id,
+            "user_name": member.name,
+            "timestamp": timestamp,
+            "action": transaction_type,
+            "price": curr_price,
+            "cash_value": position["cash_value"],
+            "stock_value": position["stock_value"]
+        }, session=session)).acknowledged
+
+    async with db.client.start_session() as session:
+        return await session.with_transaction(move_and_log)
+
+
+async def _move_position(member: discord.Member, curr_price: float,
+                         transaction_type: Literal["buy", "sell"], timestamp: datetime,
+                         session: AsyncClientSession) -> dict | None:
+    positions = db.wse_positions
+    guild = member.guild
+    holding = transaction_type == "buy"
+    last = {
         "server_name": guild.name,
-        "user_id": member.id,
         "user_name": member.name,
-        "timestamp": timestamp,
-        "action": transaction_type,
-        "price": curr_price,
-        "cash_value": cash_value,
-        "stock_value": stock_value
-    }).acknowledged
-
-
-def get_last_transaction(member: discord.Member):
+        "holding": holding,
+        "last_action": transaction_type,
+        "last_price": curr_price,
+        "last_timestamp": timestamp
+    }
+    position = await positions.find_one_and_update(
+        {"_id": {"server_id": guild.id, "user_id": member.id}, "holding": not holding},
+        {"$set": {**last, "stock_value": curr_price if holding else 0},
+         "$inc": {"cash_value": -curr_price if holding else curr_price}},
+        return_document=ReturnDocument.AFTER, session=session)
+    if position is not None or not holding:
+        return position
+
+    # a member's first buy is their opening share, worth 1 at the opening price. A
+    # duplicate key error would abort the transaction, so only insert if it's missing
+    position = {
+        "_id": {"server_id": guild.id, "user_id": member.id},
+        **last,
+        "cash_value": 0,
+        "stock_value": 1
+    }
+    result = await positions.update_one(
+        {"_id": position["_id"]},
+        {"$setOnInsert": {key: value for key, value in position.items() if key != "_id"}},
+        upsert=True, session=session)
+    if result.upserted_id is None:
+        # they already have a position, and it's holding
+        return None
+    return position
+
+
+async def get_wse_position(member: discord.Member) -> dict | None:
+    """ Returns the member's current position (holding, cash_value and their last
+        transaction), or None if they haven't traded yet """
+    positions = db.wse_positions
+    return await positions.find_one({"_id": {"server_id": member.guild.id, "user_id": member.id}})
+
+
+async def seed_wse_positions() -> None:
+    """ Builds positions from the latest transaction of every member of every guild
+        that doesn't have any positions yet """
+    transaction_log = db.wse_transaction_log
+    have_positions = await db.wse_positions.distinct("_id.server_id")
+    await (await transaction_log.aggregate([
+        {"$match": {"server_id": {"$nin": have_positions}}},
+        {"$sort": {"server_id": 1, "user_id": 1, "timestamp": -1}},
+        {"$group": {"_id": {"server_id": "$server_id", "user_id": "$user_id"},
+                    "last": {"$first": "$$ROOT"}}},
+        {"$project": {
+            "server_name": "$last.server_name",
+            "user_name": "$last.user_name",
+            "holding": {"$eq": ["$last.action", "buy"]},
+            "cash_value": "$last.cash_value",
+            "stock_value": "$last.stock_value",
+            "last_action": "$last.action",
+            "last_price": "$last.price",
+            "last_timestamp": "$last.timestamp"
+        }},
+        {"$merge": {"into": "wse_positions", "whenMatched": "keepExisting"}}
+    ])).to_list()
+
+
+async def get_last_transaction(member: discord.Member):
     transaction_log = db.wse_transaction_log
     guild = member.guild
-    query = transaction_log.find_one(
+    query = await transaction_log.find_one(
         {"server_id": guild.id, "user_id": member.id}, sort=[("timestamp", -1)])
     query_dict = {"action": None} if query is None else cast(dict, query)
     return query_dict
 
 
-def get_transactions(member: discord.Member | None = None, guild: discord.Guild | None = None):
+async def get_transactions(member: discord.Member | None = None, guild: discord.Guild | None = None):
     transaction_log = db.wse_transaction_log
     result = None
 
@@ -90,10 +189,29 @@ def get_transactions(member: discord.Member | None = None, guild: discord.Guild
         guild = member.guild
         query = transaction_log.find(
             {"server_id": guild.id, "user_id": member.id}, sort=[("timestamp", 1)])
-        result = [transaction for transaction in query]
+        result = [transaction async for transaction in query]
     elif guild is not None:
         query = transaction_log.find(
             {"server_id": guild.id}, sort=[("timestamp", 1)])
-        result = [transaction for transaction in query]
+        result = [transaction async for transaction in query]
 
     return result
+
+
+async def get_wse_leaderboard(discord_server: discord.Guild, curr_price: float,
+                              page: int | None = None, page_size: int = 10) -> list[dict]:
+    """ Returns each participant's position with their portfolio valued at curr_price
+        (stock_value, cash_value, total, net), best portfolio first. Pass a page to
+        only get that page """
+    positions = db.wse_positions
+    pipeline: list[dict] = [
+        {"$match": {"_id.server_id": discord_server.id}},
+        {"$set": {"stock_value": {"$cond": ["$holding", curr_price, 0]}}},
+        {"$set": {"total": {"$add": ["$stock_value", "$cash_value"]}}},
+        {"$set": {"net": {"$subtract": ["$total", 1]}}},
+        {"$sort": {"total": -1, "user_name": 1}}
+    ]
+    if page is not None:
+        pipeline += [{"$skip": page * page_size}, {"$limit": page_size}]
+    cursor = await positions.aggregate(pipeline)
+    return await cursor.to_list()
@@ -0,0 +1,130 @@
+import discord
+from .db_globals import *
+from .db_wse_retention import LEGACY_PRICE_COLLECTION, PRICE_COLLECTION
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from typing import Literal
+
+Resolution = Literal["tick", "day", "week"]
+
+CANDLE_RESOLUTIONS: list[Resolution] = ["day", "week"]
+""" Resolutions kept in the candle rollup, finest first """
+MAX_PRICE_POINTS = 120
+""" Most points a price history read returns, whatever the exchange's age """
+CANDLE_MIGRATION = "wse_price_candles"
+""" migrations document marking that the candle rollup has been built from history """
+
+
+def candle_bucket(timestamp: datetime, resolution: Resolution) -> datetime:
+    """ Returns the start of the day or (Monday-based) week the timestamp falls in """
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day if resolution == "day" else day - timedelta(days=day.weekday())
+
+
+def candle_requests(new_prices: dict[int, float], timestamp: datetime) -> list[UpdateOne]:
+    """ Builds the upserts that fold one tick per guild ID into its daily and weekly
+        candles. Ticks arrive in order, so the first one in a bucket is its open """
+    requests = []
+    for server_id, price in new_prices.items():
+        for resolution in CANDLE_RESOLUTIONS:
+            requests.append(UpdateOne({
+                "_id": {
+                    "server_id": server_id,
+                    "resolution": resolution,
+                    "bucket": candle_bucket(timestamp, resolution)
+                }
+            },
+                {
+                "$setOnInsert": {"open": price},
+                "$max": {"high": price},
+                "$min": {"low": price},
+                "$set": {"close": price, "close_at": timestamp}
+            },
+                upsert=True))
+    return requests
+
+
+async def rebuild_wse_candles(missing_only: bool = True) -> None:
+    """ Recomputes the candle rollup from the whole price history with one $group per
+        resolution. By default only guilds without any candles yet are rebuilt, and only
+        once (new ticks are folded into the candles as they're logged), after the legacy
+        price log has been migrated """
+    prices = db[PRICE_COLLECTION]
+    migrations = db.migrations
+    match: dict = {}
+    if missing_only:
+        if await migrations.find_one({"_id": CANDLE_MIGRATION, "done": True}) is not None:
+            return
+        if await migrations.find_one({"_id": LEGACY_PRICE_COLLECTION, "done": True}) is None:
+            return
+        have_candles = await db.wse_price_candles.distinct("_id.server_id")
+        match = {"server_id": {"$nin": have_candles}}
+
+    for resolution in CANDLE_RESOLUTIONS:
+        trunc: dict = {"date": "$timestamp", "unit": resolution}
+        if resolution == "week":
+            trunc["startOfWeek"] = "monday"
+        await (await prices.aggregate([
+            {"$match": match},
+            {"$sort": {"server_id": 1, "timestamp": 1}},
+            {"$group": {
+                "_id": {
+                    "server_id": "$server_id",
+                    "resolution": resolution,
+                    "bucket": {"$dateTrunc": trunc}
+                },
+                "open": {"$first": "$price"},
+                "high": {"$max": "$price"},
+                "low": {"$min": "$price"},
+                "close": {"$last": "$price"},
+                "close_at": {"$last": "$timestamp"}
+            }},
+            {"$merge": {"into": "wse_price_candles", "whenMatched": "replace"}}
+        ])).to_list()
+    if missing_only:
+        await migrations.update_one({"_id": CANDLE_MIGRATION},
+                                    {"$set": {"done": True, "updated": datetime.now()}},
+                                    upsert=True)
+
+
+async def get_price_history(discord_server: discord.Guild,
+                            max_points: int = MAX_PRICE_POINTS) -> tuple[Resolution, list[dict]]:
+    """ Returns the finest resolution of the guild's price history that fits in
+        max_points, as oldest-first candles (bucket, open, high, low, close). Raw ticks
+        are used while the exchange is young; if even weekly candles don't fit, only
+        the most recent max_points weeks are returned """
+    prices = db[PRICE_COLLECTION]
+    candles = db.wse_price_candles
+
+    tick_count = await prices.count_documents({"server_id": discord_server.id},
+                                              limit=max_points + 1)
+    if tick_count <= max_points:
+        ticks = prices.find({"server_id": discord_server.id},
+                            {"timestamp": 1, "price": 1}, sort=[("timestamp", 1)])
+        return "tick", [{
+            "bucket": tick["timestamp"],
+            "open": tick["price"],
+            "high": tick["price"],
+            "low": tick["price"],
+            "close": tick["price"]
+        } async for tick in ticks]
+
+    resolution: Resolution = "week"
+    for resolution in CANDLE_RESOLUTIONS:
+        count = await candles.count_documents({"_id.server_id": discord_server.id,
+                                               "_id.resolution": resolution},
+                                              limit=max_points + 1)
+        if count <= max_points:
+            break
+
+    cursor = candles.find({"_id.server_id": discord_server.id, "_id.resolution": resolution},
+                          sort=[("_id.bucket", -1)], limit=max_points)
+    result = [{
+        "bucket": candle["_id"]["bucket"],
+        "open": candle["open"],
+        "high": candle["high"],
+        "low": candle["low"],
+        "close": candle["close"]
+    } async for candle in cursor]
+    result.reverse()
+    return resolution, result
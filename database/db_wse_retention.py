@@ -0,0 +1,148 @@
+from .db_globals import *
+from datetime import datetime, timedelta
+from pymongo.errors import CollectionInvalid
+
+PRICE_COLLECTION = "wse_prices"
+""" Time-series collection of WSE prices, one measurement per guild per tick """
+LEGACY_PRICE_COLLECTION = "wse_price_log"
+""" Plain collection prices were logged to before, keyed by {server_id, timestamp} """
+MIGRATION_BATCH_SIZE = 1000
+WSE_PRICE_RETENTION_DAYS = 730
+""" Suggested days to keep raw price ticks for (the candle rollup keeps the long-run
+    history). Retention is only applied when an operator asks for it """
+CLOSED_EXCHANGE_RETENTION_DAYS = 30
+""" Days a closed exchange's transactions are kept before being compacted into a summary """
+
+
+async def ensure_wse_prices_collection() -> None:
+    """ Creates the price time-series collection, keyed by guild, if it doesn't exist """
+    try:
+        await db.create_collection(PRICE_COLLECTION, timeseries={
+            "timeField": "timestamp",
+            "metaField": "server_id",
+            "granularity": "hours"
+        })
+    except CollectionInvalid:
+        pass
+
+
+async def migrate_wse_price_log(batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """ Copies the legacy price log into the time-series collection in batches, in _id
+        order, saving progress after each batch so an interrupted run picks up where it
+        left off. Returns the number of prices copied by this run """
+    # a run interrupted between inserting a batch and saving progress leaves that batch
+    # copied, so the first batch of every run skips prices that are already there
+    migrations = db.migrations
+    legacy = db[LEGACY_PRICE_COLLECTION]
+    prices = db[PRICE_COLLECTION]
+    state = await migrations.find_one({"_id": LEGACY_PRICE_COLLECTION}) or {}
+    if state.get("done"):
+        return 0
+
+    copied = 0
+    last_id = state.get("last_id")
+    first_batch = True
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        fetched = await legacy.find(query, sort=[("_id", 1)], limit=batch_size).to_list()
+        batch = fetched
+        if fetched:
+            last_id = fetched[-1]["_id"]
+            if first_batch:
+                existing = await _copied_prices(fetched)
+                batch = [price for price in fetched
+                         if (price["_id"]["server_id"], price["_id"]["timestamp"]) not in existing]
+        first_batch = False
+        if batch:
+            await prices.insert_many([{
+                "server_id": price["_id"]["server_id"],
+                "timestamp": price["_id"]["timestamp"],
+                "price": price["price"]
+            } for price in batch], ordered=False)
+            copied += len(batch)
+        done = len(fetched) < batch_size
+        await migrations.update_one({"_id": LEGACY_PRICE_COLLECTION},
+                                    {"$set": {"last_id": last_id, "done": done,
+                                              "updated": datetime.now()},
+                                     "$inc": {"copied": len(batch)}},
+                                    upsert=True)
+        if done:
+            return copied
+
+
+async def _copied_prices(batch: list[dict]) -> set[tuple[int, datetime]]:
+    """ Returns the (server_id, timestamp) of the legacy prices in the batch that are
+        already in the time-series collection """
+    ranges: dict[int, tuple[datetime, datetime]] = {}
+    for price in batch:
+        server_id, timestamp = price["_id"]["server_id"], price["_id"]["timestamp"]
+        start, end = ranges.get(server_id, (timestamp, timestamp))
+        ranges[server_id] = (min(start, timestamp), max(end, timestamp))
+    existing = db[PRICE_COLLECTION].find({"$or": [
+        {"server_id": server_id, "timestamp": {"$gte": start, "$lte": end}}
+        for server_id, (start, end) in ranges.items()
+    ]}, {"_id": 0, "server_id": 1, "timestamp": 1})
+    return {(price["server_id"], price["timestamp"]) async for price in existing}
+
+
+async def apply_wse_price_retention(days: int | None) -> None:
+    """ Sets how long the price time-series collection keeps ticks for (None keeps
+        them forever) """
+    await db.command("collMod", PRICE_COLLECTION,
+                     expireAfterSeconds="off" if days is None else int(timedelta(days=days).total_seconds()))
+
+
+async def compact_closed_wse_transactions(days: int = CLOSED_EXCHANGE_RETENTION_DAYS) -> int:
+    """ Folds the transactions of exchanges that have been closed for more than the
+        given number of days into one summary document per guild (per-member totals
+        and final portfolio) and deletes them, returns how many were compacted """
+    connected_servers = db.connected_servers
+    transaction_log = db.wse_transaction_log
+    cutoff = datetime.now() - timedelta(days=days)
+    # exchanges closed before wse_closed_at was recorded have no known closing date, so
+    # they're kept until they're opened and closed again
+    closed = await connected_servers.distinct("_id", {
+        "wse": False,
+        "wse_closed_at": {"$lt": cutoff}
+    })
+    if not closed:
+        return 0
+
+    match = {"server_id": {"$in": closed}, "timestamp": {"$lt": cutoff}}
+    await (await transaction_log.aggregate([
+        {"$match": match},
+        {"$sort": {"server_id": 1, "user_id": 1, "timestamp": 1}},
+        {"$group": {
+            "_id": {"server_id": "$server_id", "user_id": "$user_id"},
+            "server_name": {"$last": "$server_name"},
+            "user_name": {"$last": "$user_name"},
+            "transactions": {"$sum": 1},
+            "buys": {"$sum": {"$cond": [{"$eq": ["$action", "buy"]}, 1, 0]}},
+            "sells": {"$sum": {"$cond": [{"$eq": ["$action", "sell"]}, 1, 0]}},
+            "first": {"$first": "$timestamp"},
+            "last": {"$last": "$timestamp"},
+            "last_action": {"$last": "$action"},
+            "cash_value": {"$last": "$cash_value"},
+            "stock_value": {"$last": "$stock_value"}
+        }},
+        {"$group": {
+            "_id": "$_id.server_id",
+            "server_name": {"$last": "$server_name"},
+            "from": {"$min": "$first"},
+            "until": {"$max": "$last"},
+            "transactions": {"$sum": "$transactions"},
+            "members": {"$push": {
+                "user_id": "$_id.user_id",
+                "user_name": "$user_name",
+                "transactions": "$transactions",
+                "buys": "$buys",
+                "sells": "$sells",
+                "last_action": "$last_action",
+                "cash_value": "$cash_value",
+                "stock_value": "$stock_value"
+            }}
+        }},
+        {"$set": {"_id": {"server_id": "$_id", "until": "$until"}}},
+        {"$merge": {"into": "wse_exchange_summaries", "whenMatched": "replace"}}
+    ])).to_list()
+    return (await transaction_log.delete_many(match)).deleted_count
@@ -0,0 +1,57 @@
+""" Blocking wrappers around the async database API, for the Walarus Shell and scripts.
+
+Usage: `from database import sync as db`, then call the same functions as the
+`database` package without awaiting them (e.g. `db.get_wse_status(guild)`) """
+import asyncio
+import database as _db
+import functools
+import inspect
+import threading
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """ Run all shimmed DB calls on the given (running) event loop. The async Mongo
+        client can only be used from one event loop, so this should be the bot's loop """
+    global _loop
+    with _loop_lock:
+        _loop = loop
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """ Returns the loop DB calls are dispatched to, starting a background one
+        if the bot hasn't bound its loop (e.g. standalone scripts) """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name="database-sync", daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """ Runs the given coroutine on the DB event loop and blocks until it's done """
+    loop = _get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("database.sync can't be used from the event loop it runs on, "
+                           "await the database function instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def __getattr__(name: str):
+    attr = getattr(_db, name)
+    if not inspect.iscoroutinefunction(attr):
+        return attr
+
+    @functools.wraps(attr)
+    def wrapper(*args, **kwargs):
+        return run(attr(*args, **kwargs))
+    return wrapper
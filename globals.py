@@ -1,4 +1,4 @@
-from models import VCConnection, Election, Server, WSESession
+from models import VCConnection, Election, Server, TimerQueue, VoiceSession, WSEScheduler, WSESession
 from discord import Guild
 import threading
 
@@ -13,3 +13,12 @@ elections: dict[Guild, Election] = {}
 
 live_wse_sessions: dict[Guild, WSESession] = {}
 """Contains servers with active WSE sessions """
+
+wse_scheduler: WSEScheduler = WSEScheduler()
+""" Ticks the prices of all live WSE sessions """
+
+voice_sessions: dict[int, VoiceSession] = {}
+""" Contains occupied voice channels, by channel ID """
+
+timers: TimerQueue = TimerQueue()
+""" Fires scheduled per-guild work (archives, ...) at its due time """
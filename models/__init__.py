@@ -1,5 +1,10 @@
+from models.archive_run import ArchiveRun
+from models.channel_index import ChannelIndex
 from models.election import Election
 from models.server import Server
 from models.vc_connection import VCConnection
 from models.time_span import TimeSpan
-from models.wse_session import WSESession
\ No newline at end of file
+from models.wse_session import WSESession
+from models.wse_scheduler import WSEScheduler
+from models.voice_session import VoiceSession
+from models.timer_queue import TimerQueue
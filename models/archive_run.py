@@ -0,0 +1,40 @@
+from datetime import datetime
+import discord
+
+
+class ArchiveRun:
+    """ Class that records how archiving went in each guild during one archive run """
+
+    def __init__(self) -> None:
+        self.started: datetime = datetime.now()
+        """ When the run started """
+        self.finished: datetime | None = None
+        """ When the last guild finished (None while the run is going) """
+        self.results: dict[int, tuple[str, str, float, str | None]] = {}
+        """ (guild name, outcome, seconds taken, error) of each guild, by guild ID """
+        self.progress: dict[int, str] = {}
+        """ Last step each guild got through, by guild ID, so a timeout shows how far it got """
+
+    def __str__(self) -> str:
+        finished = "running" if self.finished is None else f"took {self.finished - self.started}"
+        outcomes = ", ".join(f"{outcome}={count}" for outcome, count in self.outcome_counts().items())
+        lines = [f"ArchiveRun: started {self.started}, {finished}, {outcomes or 'no guilds'}"]
+        for guild_id, (guild_name, outcome, seconds, error) in self.results.items():
+            line = f"\t'{guild_name}' (id: {guild_id}): {outcome} in {seconds:.1f}s"
+            lines.append(line if error is None else f"{line} ({error})")
+        return "\n".join(lines)
+
+    def record(self, guild: discord.Guild, outcome: str, seconds: float, error: str | None = None) -> None:
+        self.results[guild.id] = (guild.name, outcome, seconds, error)
+
+    def reach(self, guild: discord.Guild, step: str) -> None:
+        self.progress[guild.id] = step
+
+    def finish(self) -> None:
+        self.finished = datetime.now()
+
+    def outcome_counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for _, outcome, _, _ in self.results.values():
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return counts
@@ -0,0 +1,84 @@
+import discord
+
+
+class ChannelIndex:
+    """ Class that indexes a guild's categories and text channels by case-folded name and
+        counts the channels in each category, so lookups don't scan the whole guild """
+
+    def __init__(self, guild: discord.Guild) -> None:
+        self.guild: discord.Guild = guild
+        """ Guild whose channels are indexed """
+        self.categories: dict[str, dict[int, discord.CategoryChannel]] = {}
+        """ Categories by case-folded name, then by ID """
+        self.text_channels: dict[str, dict[int, discord.TextChannel]] = {}
+        """ Text channels by case-folded name, then by ID """
+        self.child_counts: dict[int, int] = {}
+        """ Number of channels (of any type) in each category, by category ID """
+        for channel in guild.channels:
+            self.add(channel)
+
+    def __str__(self) -> str:
+        return (f"ChannelIndex: '{self.guild.name}', {len(self.child_counts)} categories, "
+                f"{sum(len(channels) for channels in self.text_channels.values())} text channels")
+
+    def add(self, channel: discord.abc.GuildChannel) -> None:
+        if isinstance(channel, discord.CategoryChannel):
+            self.categories.setdefault(channel.name.casefold(), {})[channel.id] = channel
+            self.child_counts.setdefault(channel.id, 0)
+            return
+        if isinstance(channel, discord.TextChannel):
+            self.text_channels.setdefault(channel.name.casefold(), {})[channel.id] = channel
+        if channel.category_id is not None:
+            self.child_counts[channel.category_id] = self.child_counts.get(channel.category_id, 0) + 1
+
+    def remove(self, channel: discord.abc.GuildChannel) -> None:
+        if isinstance(channel, discord.CategoryChannel):
+            ChannelIndex.__discard(self.categories, channel)
+            self.child_counts.pop(channel.id, None)
+            return
+        if isinstance(channel, discord.TextChannel):
+            ChannelIndex.__discard(self.text_channels, channel)
+        if channel.category_id in self.child_counts:
+            self.child_counts[channel.category_id] -= 1
+
+    def update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel) -> None:
+        self.remove(before)
+        self.add(after)
+
+    def find_category(self, name: str, case_sens: bool = False) -> discord.CategoryChannel | None:
+        """ Returns the top-most category with the given name """
+        candidates = [category for category in self.categories.get(name.casefold(), {}).values()
+                      if not case_sens or category.name == name]
+        return min(candidates, key=lambda category: (category.position, category.id), default=None)
+
+    def find_categories(self, name: str, case_sens: bool = False) -> list[discord.CategoryChannel]:
+        """ Returns every category with the given name, top-most first """
+        candidates = [category for category in self.categories.get(name.casefold(), {}).values()
+                      if not case_sens or category.name == name]
+        return sorted(candidates, key=lambda category: (category.position, category.id))
+
+    def find_text_channel(self, name: str, case_sens: bool = False) -> discord.TextChannel | None:
+        """ Returns the text channel with the given name, preferring channels in the
+            top-most category and then channels that aren't in one """
+        candidates = [channel for channel in self.text_channels.get(name.casefold(), {}).values()
+                      if not case_sens or channel.name == name]
+
+        def sort_key(channel: discord.TextChannel) -> tuple:
+            category = channel.category
+            if category is None:
+                return (1, 0, 0, channel.position, channel.id)
+            return (0, category.position, category.id, channel.position, channel.id)
+
+        return min(candidates, key=sort_key, default=None)
+
+    def child_count(self, category: discord.CategoryChannel) -> int:
+        return self.child_counts.get(category.id, 0)
+
+    @staticmethod
+    def __discard(index: dict, channel: discord.abc.GuildChannel) -> None:
+        channels = index.get(channel.name.casefold())
+        if channels is None:
+            return
+        channels.pop(channel.id, None)
+        if not channels:
+            del index[channel.name.casefold()]
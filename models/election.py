@@ -1,25 +1,93 @@
 from datetime import datetime, timedelta
 import discord
 from models.server import Server
+import pytz
+import random
 import utilities as ut
 
 
 class Election:
-    """ Class that encapsulates election info per guild """
+    """ Class that encapsulates election info per guild. Holds everything needed to carry
+        on after a restart (the pools still to draw from and when the next draw is) """
 
-    def __init__(self, server: Server) -> None:
+    def __init__(self, server: Server, channel: discord.TextChannel, members: list[int],
+                 roles: list[int], cadence_minutes: int) -> None:
         self.server: Server = server
         """ Server that election is occurring in """
-        self.start_time = ut.now_time(server)
+        self.channel: discord.TextChannel = channel
+        """ Channel election results are announced in """
+        self.start_time: datetime = ut.now_time(server)
         """ Datetime of the start of the election """
-        self.next_time: datetime = self.start_time + \
-            timedelta(minutes=server.rc_int)
+        self.cadence_minutes: int = cadence_minutes
+        """ Minutes between draws """
+        self.next_time: datetime = self.start_time + timedelta(minutes=cadence_minutes)
         """ Datetime of next election """
-        self.roles = server.rshuffle
-        """ List of roles that are to be shuffled """
-        self.members = server.ushuffle
-        """ List of members whose roles are to be shuffled """
+        self.roles: list[int] = roles
+        """ IDs of the roles that are handed out """
+        self.remaining_roles: list[int] = list(roles)
+        """ IDs of the roles not handed out yet this round (refilled once empty) """
+        self.members: list[int] = members
+        """ IDs of the members still waiting to be drawn """
 
     def __str__(self) -> str:
         guild: discord.Guild = self.server.guild
         return f"Guild '{guild.name}' (id: {guild.id}), next_time at {ut.timef(self.next_time)}"
+
+    def is_done(self) -> bool:
+        return not self.members
+
+    def draw(self) -> tuple[int, int]:
+        """ Draws the next (member ID, role ID) and removes them from their pools """
+        if not self.remaining_roles:
+            self.remaining_roles = list(self.roles)
+        member_id = random.choice(self.members)
+        role_id = random.choice(self.remaining_roles)
+        self.members.remove(member_id)
+        self.remaining_roles.remove(role_id)
+        return member_id, role_id
+
+    def advance(self, now: datetime) -> None:
+        """ Moves next_time on by whole cadences until it's after now, counting on the
+            server's wall clock, so a late or resumed draw neither fires its missed draws
+            back to back nor shifts later draws off their configured time """
+        tz = pytz.timezone(self.server.timezone)
+        cadence = timedelta(minutes=self.cadence_minutes)
+        local = self.next_time.astimezone(tz).replace(tzinfo=None)
+        local_now = now.astimezone(tz).replace(tzinfo=None)
+        local += cadence * max(1, (local_now - local) // cadence + 1)
+        while tz.localize(local) <= now:
+            local += cadence
+        self.next_time = tz.localize(local)
+
+    def forget_role(self, role_id: int) -> None:
+        """ Stops handing out a role that was deleted """
+        if role_id in self.roles:
+            self.roles.remove(role_id)
+        if role_id in self.remaining_roles:
+            self.remaining_roles.remove(role_id)
+
+    def to_document(self) -> dict:
+        guild: discord.Guild = self.server.guild
+        return {
+            "_id": guild.id,
+            "server_name": guild.name,
+            "channel_id": self.channel.id,
+            "start_time": self.start_time,
+            "next_time": self.next_time,
+            "cadence_minutes": self.cadence_minutes,
+            "members": self.members,
+            "roles": self.roles,
+            "remaining_roles": self.remaining_roles,
+            "done": self.is_done()
+        }
+
+    @staticmethod
+    def from_document(server: Server, channel: discord.TextChannel, document: dict) -> "Election":
+        """ Rebuilds a persisted election (Mongo hands datetimes back as naive UTC) """
+        tz = pytz.timezone(server.timezone)
+        election = Election(server, channel, list(document["members"]), list(document["roles"]),
+                            document["cadence_minutes"])
+        election.start_time = document["start_time"].replace(tzinfo=pytz.utc).astimezone(tz)
+        election.next_time = document["next_time"].replace(tzinfo=pytz.utc).astimezone(tz)
+        election.remaining_roles = list(document["remaining_roles"])
+        return election
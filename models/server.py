@@ -1,23 +1,68 @@
+from datetime import datetime, timedelta
 from discord import Guild, User
 import database as db
+from models.channel_index import ChannelIndex
+import pytz
 
 
 class Server:
     """ Class that encapsulates a Guild object and additional info about a server """
 
-    def __init__(self, guild: Guild) -> None:
+    def __init__(self, guild: Guild, rshuffle: list[str] | None = None,
+                 ushuffle: list[str] | None = None, archive_int: int | None = None,
+                 timezone: str | None = None, next_archive_at: datetime | None = None) -> None:
         self.guild: Guild = guild
         """ Pycord Guild object associated with this server """
-        self.rshuffle: list[str] = db.get_rshuffle(guild)
+        self.rshuffle: list[str] = [] if rshuffle is None else rshuffle
         """ String list of roles involved in role change """
-        self.ushuffle: list[str] = db.get_ushuffle(guild)
+        self.ushuffle: list[str] = [] if ushuffle is None else ushuffle
         """ List of users involved in role change """
-        self.archive_int: int = 2
+        self.archive_int: int = 2 if archive_int is None else archive_int
         """ General chat archive interval (in weeks) """
         self.rc_int: int = 1
         """ Role change interval (in minutes) """
-        self.timezone: str = "US/Eastern"
+        self.timezone: str = "US/Eastern" if timezone is None else timezone
         """ Timezone of server """
+        self.next_archive_at: datetime | None = next_archive_at
+        """ When general chat is next archived (timezone-aware), None if not scheduled yet """
+        self.channels: ChannelIndex = ChannelIndex(guild)
+        """ Categories and text channels by name (kept up to date by the channel events) """
 
     def __str__(self) -> str:
         return f"'{self.guild.name}': {self.guild.member_count} members (id: {self.guild.id})"
+
+    @staticmethod
+    async def load(guild: Guild) -> "Server":
+        """ Builds the Server for the given guild with its role change info from the DB """
+        return Server.from_settings(guild, await db.get_server_settings(guild))
+
+    @staticmethod
+    async def load_all(guilds: list[Guild]) -> dict[Guild, "Server"]:
+        """ Builds the Servers for all the given guilds from one bulk DB load """
+        settings = await db.load_servers(guilds)
+        return {guild: Server.from_settings(guild, settings[guild.id]) for guild in guilds}
+
+    @staticmethod
+    def from_settings(guild: Guild, settings: dict) -> "Server":
+        """ Builds the Server for the given guild from its connected_servers settings """
+        next_archive_at = settings.get("next_archive_at")
+        return Server(guild,
+                      rshuffle=settings.get("rshuffle"),
+                      ushuffle=settings.get("ushuffle"),
+                      archive_int=settings.get("archive_int"),
+                      timezone=settings.get("timezone"),
+                      next_archive_at=None if next_archive_at is None
+                      else next_archive_at.replace(tzinfo=pytz.utc))
+
+    def next_archive_after(self, previous: datetime, now: datetime) -> datetime:
+        """ Returns the first archive time after now that's a whole number of archive
+            intervals after previous, counted on the server's wall clock so archives
+            keep their local time of day across DST changes """
+        tz = pytz.timezone(self.timezone)
+        local = previous.astimezone(tz).replace(tzinfo=None)
+        step = timedelta(weeks=max(self.archive_int, 1))
+        next_run = tz.localize(local + step)
+        while next_run <= now:
+            local += step
+            next_run = tz.localize(local + step)
+        return next_run
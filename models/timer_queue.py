@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timezone
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Hashable
+
+MAX_WAIT = 3600
+""" Longest single sleep (in seconds), so wall-clock jumps get noticed within the hour """
+
+
+class TimerQueue:
+    """ Class that fires async callbacks at their due times from one asyncio task. Timers
+        live in a heap, so only the earliest one is ever waited on however many there are """
+    log = logging.getLogger(f"{__name__}.TimerQueue")
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[datetime, int, Hashable]] = []
+        """ (due, sequence number, key) of every scheduled timer, earliest first. Entries
+            for cancelled or rescheduled timers are skipped when they reach the top """
+        self.timers: dict[Hashable, tuple[datetime, int, Callable[[], Awaitable]]] = {}
+        """ Live (due, sequence number, callback) of each timer, by key """
+        self.sequence = itertools.count()
+        self.changed: asyncio.Event | None = None
+        """ Set whenever a timer is added, so the runner re-checks the earliest due time """
+        self.task: asyncio.Task | None = None
+        self.running: set[asyncio.Task] = set()
+        """ Callbacks that have fired and haven't finished yet """
+
+    def __str__(self) -> str:
+        upcoming = min((due for due, _, _ in self.timers.values()), default=None)
+        return f"TimerQueue: {len(self.timers)} timer(s), next due {upcoming}"
+
+    def schedule(self, key: Hashable, due: datetime, callback: Callable[[], Awaitable]) -> None:
+        """ Runs the callback at the given (timezone-aware) time, replacing any timer
+            already scheduled under the same key """
+        sequence = next(self.sequence)
+        self.timers[key] = (due, sequence, callback)
+        heapq.heappush(self.heap, (due, sequence, key))
+        if self.changed is not None:
+            self.changed.set()
+
+    def cancel(self, key: Hashable) -> None:
+        self.timers.pop(key, None)
+
+    def due(self, key: Hashable) -> datetime | None:
+        """ Returns when the timer under the given key is due, None if there isn't one """
+        timer = self.timers.get(key)
+        return None if timer is None else timer[0]
+
+    def start(self) -> None:
+        """ Starts firing timers on the running event loop, if not already started """
+        if self.task is None or self.task.done():
+            self.changed = asyncio.Event()
+            self.task = asyncio.create_task(self.__run())
+
+    async def __run(self) -> None:
+        changed = self.changed
+        assert changed is not None
+        while True:
+            changed.clear()
+            while self.heap and self.__stale(self.heap[0]):
+                heapq.heappop(self.heap)
+
+            if self.heap:
+                wait = (self.heap[0][0] - datetime.now(timezone.utc)).total_seconds()
+                if wait <= 0:
+                    _, _, key = heapq.heappop(self.heap)
+                    _, _, callback = self.timers.pop(key)
+                    task = asyncio.create_task(self.__fire(key, callback))
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+                    continue
+            else:
+                wait = MAX_WAIT
+
+            try:
+                await asyncio.wait_for(changed.wait(), min(wait, MAX_WAIT))
+            except asyncio.TimeoutError:
+                pass
+
+    def __stale(self, entry: tuple[datetime, int, Hashable]) -> bool:
+        _, sequence, key = entry
+        timer = self.timers.get(key)
+        return timer is None or timer[1] != sequence
+
+    @staticmethod
+    async def __fire(key: Hashable, callback: Callable[[], Awaitable]) -> None:
+        try:
+            await callback()
+        except Exception as ex:
+            TimerQueue.log.error(f"Timer {key} failed: {ex}")
@@ -0,0 +1,59 @@
+from datetime import datetime
+import discord
+
+
+class VoiceSession:
+    """ Class that tracks who is connected to a voice channel and whether their VC timer is running """
+
+    def __init__(self, channel: discord.VoiceChannel) -> None:
+        self.channel: discord.VoiceChannel = channel
+        """ Voice channel this session is tracking """
+        self.members: dict[int, discord.Member] = {}
+        """ Members currently connected, by member ID """
+        self.connected: dict[int, datetime] = {}
+        """ When each connected member joined the channel, by member ID """
+        self.timer_started: datetime | None = None
+        """ Start of the current timed segment (None while fewer than 2 non-bots are connected) """
+
+    def __str__(self) -> str:
+        timer = "off" if self.timer_started is None else f"on since {self.timer_started}"
+        return f"VoiceSession: channel='{self.channel.name}', members={len(self.members)}, timer {timer}"
+
+    def non_bot_count(self) -> int:
+        return sum(1 for member in self.members.values() if not member.bot)
+
+    def join(self, member: discord.Member, now: datetime) -> None:
+        """ Registers a member joining the channel, starting a timed segment if they're
+            the second non-bot to be connected """
+        self.members[member.id] = member
+        self.connected[member.id] = now
+        if self.timer_started is None and self.non_bot_count() > 1:
+            self.timer_started = now
+
+    def leave(self, member: discord.Member, now: datetime) -> dict[discord.Member, datetime]:
+        """ Registers a member leaving the channel, returns when the VC time each member
+            accrued started (the leaving member, plus everyone else if the segment
+            closed). The accrued time runs from there until now """
+        accrued: dict[discord.Member, datetime] = {}
+        if member.id not in self.members:
+            return accrued
+
+        if self.timer_started is not None:
+            accrued[member] = self.__timed_since(member.id)
+        del self.members[member.id]
+        del self.connected[member.id]
+
+        if self.timer_started is not None and self.non_bot_count() <= 1:
+            # segment closes, so everyone left in the channel stops accruing
+            for member_id, remaining in self.members.items():
+                accrued[remaining] = self.__timed_since(member_id)
+            self.timer_started = None
+
+        return {member: since for member, since in accrued.items() if since < now}
+
+    def is_empty(self) -> bool:
+        return not self.members
+
+    def __timed_since(self, member_id: int) -> datetime:
+        """ When the given member started accruing time in the current timed segment """
+        return max(self.connected[member_id], self.timer_started)
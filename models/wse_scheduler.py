@@ -0,0 +1,68 @@
+from apscheduler.job import Job
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+import asyncio
+import database as db
+from discord import Guild
+import logging
+from models.wse_session import WSESession
+
+
+class WSEScheduler:
+    """ Class that owns the one process-wide scheduler ticking the price of every live
+        WSE session. Sessions sharing a cron expression share a job, and each tick
+        writes every due guild's new price in one bulk write """
+    log = logging.getLogger(f"{__name__}.WSEScheduler")
+
+    def __init__(self) -> None:
+        self.scheduler: AsyncIOScheduler = AsyncIOScheduler()
+        """ APScheduler scheduler running on the bot's event loop """
+        self.sessions: dict[str, dict[int, WSESession]] = {}
+        """ Live sessions by cron expression, then by guild ID """
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Starts ticking on the given (running) event loop, if not already started """
+        if not self.scheduler.running:
+            self.scheduler.configure(event_loop=loop)
+            self.scheduler.start()
+
+    def add(self, session: WSESession) -> Job:
+        """ Schedules price ticks for the given session """
+        self.remove(session.guild)
+        job_id = WSEScheduler.__job_id(session.cron_exp)
+        job = self.scheduler.get_job(job_id)
+        if job is None:
+            job = self.scheduler.add_job(self.tick, CronTrigger.from_crontab(session.cron_exp),
+                                         args=[session.cron_exp], id=job_id)
+        self.sessions.setdefault(session.cron_exp, {})[session.guild.id] = session
+        session.job = job
+        return job
+
+    def remove(self, guild: Guild) -> None:
+        """ Stops ticking the guild's session, removing its job if nothing else uses it """
+        for cron_exp, sessions in list(self.sessions.items()):
+            session = sessions.pop(guild.id, None)
+            if session is None:
+                continue
+            session.job = None
+            if not sessions:
+                del self.sessions[cron_exp]
+                if self.scheduler.get_job(WSEScheduler.__job_id(cron_exp)) is not None:
+                    self.scheduler.remove_job(WSEScheduler.__job_id(cron_exp))
+
+    async def tick(self, cron_exp: str) -> None:
+        """ Moves the price of every session due on the given cron expression """
+        new_prices: dict[Guild, float] = {}
+        for session in list(self.sessions.get(cron_exp, {}).values()):
+            old_price = await db.get_current_wse_price(session.guild)
+            new_price = WSESession.get_new_wse_price(old_price)
+            if new_price != old_price:
+                new_prices[session.guild] = new_price
+        try:
+            await db.set_current_wse_prices(new_prices)
+        except Exception as ex:
+            WSEScheduler.log.error(f"Failed to write WSE price tick for '{cron_exp}': {ex}")
+
+    @staticmethod
+    def __job_id(cron_exp: str) -> str:
+        return f"wse-tick:{cron_exp}"
@@ -1,9 +1,7 @@
 from discord import Guild, User
-import database as db
+from database import sync as db_sync
 from apscheduler.job import Job
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-import random
+from simulation import next_wse_price
 
 
 class WSESession:
@@ -14,26 +12,18 @@ class WSESession:
         """ Server that the session is running in """
         self.user_id = user_id
         """ User ID of the user we're tracking """
-        cron_trigger = CronTrigger.from_crontab(cron_exp)
-        scheduler = BackgroundScheduler()
-        self.job: Job = scheduler.add_job(
-            self.__get_new_wse_price, cron_trigger, args=[True])
-        """ APScheduler job used for fetching next price change timestamp """
-        scheduler.start()
+        self.cron_exp: str = cron_exp
+        """ Crontab expression of when the price changes """
+        self.job: Job | None = None
+        """ Shared scheduler job that ticks this session's price (set by WSEScheduler) """
 
     def __str__(self) -> str:
-        curr_price = db.get_current_wse_price(self.guild)
-        return (f"'{self.guild.name}' ({self.user_id}): ${curr_price} (next price change: {self.job.next_run_time})")
+        # only called off the event loop (e.g. from the Walarus Shell)
+        curr_price = db_sync.get_current_wse_price(self.guild)
+        next_run_time = None if self.job is None else self.job.next_run_time
+        return (f"'{self.guild.name}' ({self.user_id}): ${curr_price} (next price change: {next_run_time})")
 
-    def __get_new_wse_price(self, write: bool = False) -> float:
-        old_price = db.get_current_wse_price(self.guild)
-        rate = random.randint(-200, 700) / 10000
-        delta = old_price * rate
-
-        if abs(delta) < 0.01:
-            return old_price
-
-        new_price = old_price + delta
-        if write:
-            db.set_current_wse_price(self.guild, new_price)
-        return new_price
+    @staticmethod
+    def get_new_wse_price(old_price: float) -> float:
+        """ Random daily step of -2% to +7%, changes under a cent are skipped """
+        return next_wse_price(old_price)
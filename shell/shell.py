@@ -1,5 +1,9 @@
+from backfill import HistoryBackfill
+from database import sync as db
+from datetime import datetime
 from globals import servers, vc_connections, elections, live_wse_sessions
 import os
+from simulation import simulate_wse_percentiles, DEFAULT_PERCENTILES
 
 
 class _Command:
@@ -20,15 +24,67 @@ def show_globals() -> None:
         print(
             f"\tConnected to '{conn.voice_client.channel}' in '{guild.name}'")
     print(f"elections:")
-    for guild in elections.keys():
-        print(f"\tActive election in '{guild.name}'")
+    for election in elections.values():
+        print(f"\tActive election: {election}")
     print(f"live_wse_sessions:")
     for guild in live_wse_sessions.values():
         print(f"\t{str(guild)}")
 
 
+def check_indexes() -> None:
+    for collection, report in db.report_indexes().items():
+        print(f"{collection}:")
+        for kind, names in report.items():
+            print(f"\t{kind}: {', '.join(names) if names else '-'}")
+    db.check_query_plans()
+    print("No hot queries are doing a COLLSCAN")
+
+
+def backfill_stats() -> None:
+    print("Only backfill time the bot wasn't running for, counts are added to the live totals")
+    after = input("Count messages after (YYYY-MM-DD): ").strip()
+    before = input("Count messages before (YYYY-MM-DD, stops at when the bot started): ").strip()
+    engine = HistoryBackfill(
+        list(servers.keys()),
+        after=datetime.strptime(after, "%Y-%m-%d"),
+        before=datetime.strptime(before, "%Y-%m-%d"))
+
+    async def print_progress(engine: HistoryBackfill) -> None:
+        print(f"\t{engine}")
+
+    db.run(engine.run(on_progress=print_progress))
+
+
+def simulate_wse() -> None:
+    start_price = float(input("Starting price (blank for $1.00): ").strip() or 1.00)
+    days = int(input("Days to simulate (blank for 365): ").strip() or 365)
+    paths = int(input("Paths to simulate (blank for 10000): ").strip() or 10000)
+    started = datetime.now()
+    bands = simulate_wse_percentiles(start_price, days, paths)
+    print(f"Simulated {paths:,} paths over {days:,} days in {datetime.now() - started}")
+    for day in sorted({0, days // 4, days // 2, 3 * days // 4, days}):
+        prices = ", ".join(f"p{p}=${price:,.2f}" for p, price in zip(DEFAULT_PERCENTILES, bands[:, day]))
+        print(f"\tDay {day}: {prices}")
+
+
+def maintain_wse_logs() -> None:
+    copied = db.migrate_wse_price_log()
+    print(f"Copied {copied} prices from the legacy price log to the time-series collection")
+    days = input(f"Days to keep raw price ticks for (e.g. {db.WSE_PRICE_RETENTION_DAYS}, "
+                 f"'forever' to keep them, blank to leave retention as it is): ").strip()
+    if days:
+        db.apply_wse_price_retention(None if days == "forever" else int(days))
+        print("Raw price tick retention updated")
+    days = input(f"Days to keep closed exchanges' transactions for "
+                 f"(blank for {db.CLOSED_EXCHANGE_RETENTION_DAYS}): ").strip()
+    compacted = db.compact_closed_wse_transactions(int(days) if days
+                                                   else db.CLOSED_EXCHANGE_RETENTION_DAYS)
+    print(f"Compacted {compacted} transactions of closed exchanges into summaries")
+
+
 def exit_walarus() -> None:
     try:
+        db.flush_user_stats()
         os._exit(0)
     except Exception as ex:
         print(str(ex))
@@ -40,9 +96,17 @@ def help() -> None:
 
 
 cmd_map: dict = {
+    "backfill": _Command("backfill", "Count message stats from channel history for an outage in every server",
+                         backfill_stats),
     "exit": _Command("exit", "Close shell and terminate General Walarus", exit_walarus),
     "globals": _Command("globals", "Display current value of global variables", show_globals),
     "help": _Command("help", "List out all the Walarus Shell commands", help),
+    "indexes": _Command("indexes", "Report missing/unused indexes and check hot query plans",
+                        check_indexes),
+    "simulate": _Command("simulate", "Run a Monte Carlo simulation of the WSE price model",
+                         simulate_wse),
+    "wselogs": _Command("wselogs", "Migrate WSE prices to time-series, apply retention and compact closed exchanges",
+                        maintain_wse_logs),
 }
 
 
@@ -0,0 +1,3 @@
+""" Offline simulations of the WSE. Kept free of bot/DB imports like charts """
+from simulation.wse_price_model import next_wse_price, step_wse_prices
+from simulation.wse_monte_carlo import simulate_wse_percentiles, DEFAULT_PERCENTILES
@@ -0,0 +1,31 @@
+import numpy as np
+from simulation.wse_price_model import STEP_RANGE, step_wse_prices
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+STEP_BATCH = 256
+""" Steps worth of random draws generated at a time, bounds memory on long horizons """
+
+
+def simulate_wse_percentiles(start_price: float, days: int, paths: int,
+                             percentiles=DEFAULT_PERCENTILES,
+                             seed: int | None = None) -> np.ndarray:
+    """ Runs the WSE price model for the given number of paths and days, all paths
+        at once, and returns the price percentiles after each day as an array of
+        shape (len(percentiles), days + 1). Only the current price of each path is
+        kept, so memory doesn't grow with the horizon """
+    rng = np.random.default_rng(seed)
+    prices = np.full(paths, start_price, dtype=np.float64)
+    result = np.empty((len(percentiles), days + 1))
+    result[:, 0] = start_price
+
+    day = 0
+    while day < days:
+        batch = min(STEP_BATCH, days - day)
+        steps = rng.integers(STEP_RANGE[0], STEP_RANGE[1], size=(batch, paths),
+                             endpoint=True)
+        for row in steps:
+            prices = step_wse_prices(prices, row)
+            day += 1
+            result[:, day] = np.percentile(prices, percentiles)
+
+    return result
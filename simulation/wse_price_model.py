@@ -0,0 +1,26 @@
+import numpy as np
+import random
+
+STEP_RANGE = (-200, 700)
+""" Inclusive range of the random daily step, in units of STEP_SCALE (-2% to +7%) """
+STEP_SCALE = 10000
+MIN_PRICE_CHANGE = 0.01
+""" Price changes smaller than this (under a cent) are skipped """
+
+
+def next_wse_price(old_price: float) -> float:
+    """ Takes one random step of the WSE price model """
+    rate = random.randint(*STEP_RANGE) / STEP_SCALE
+    delta = old_price * rate
+
+    if abs(delta) < MIN_PRICE_CHANGE:
+        return old_price
+
+    return old_price + delta
+
+
+def step_wse_prices(prices: np.ndarray, steps: np.ndarray) -> np.ndarray:
+    """ Takes one step of the WSE price model for every path at once, given each
+        path's raw step drawn from STEP_RANGE """
+    delta = prices * (steps / STEP_SCALE)
+    return np.where(np.abs(delta) < MIN_PRICE_CHANGE, prices, prices + delta)
@@ -70,7 +70,7 @@ async def send_user_to_timeout(guild: discord.Guild,
         return
 
     await asyncio.sleep(delay)
-    timeout_role_str = db.get_timeout_role(guild)
+    timeout_role_str = await db.get_timeout_role(guild)
     timeout_role = None
 
     for role in guild.roles: